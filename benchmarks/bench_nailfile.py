@@ -0,0 +1,223 @@
+"""
+Throughput benchmarks for the NailFile readers, loader and query paths.
+
+Synthetic csv and fixed-width files are generated for each combination of
+row count and column count, and every benchmark reports rows per second,
+timed with memory tracing off, and peak traced memory from a separate
+run. Results are written as JSON so runs can be compared across commits:
+
+    $> python benchmarks/bench_nailfile.py --rows 10000,100000 --columns 10,50 --output before.json
+    $> python benchmarks/bench_nailfile.py --rows 10000,100000 --columns 10,50 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nailfile import nailfile
+from nailfile import readers
+
+FIELD_WIDTH = 10
+
+
+def generate_files(directory, num_rows, num_columns, seed=0):
+    """
+    Writes a csv file and a fixed-width file with the same data, mixing
+    numbers, dates and text
+    """
+    rnd = random.Random(seed)
+    names = ["col{0:03d}".format(i) for i in range(num_columns)]
+    csv_path = os.path.join(directory, "data_{0}x{1}.csv".format(num_rows, num_columns))
+    fixed_path = os.path.join(directory, "data_{0}x{1}.txt".format(num_rows, num_columns))
+    with open(csv_path, 'w') as csv_file, open(fixed_path, 'w') as fixed_file:
+        csv_file.write(",".join(names) + "\n")
+        for row_num in range(num_rows):
+            values = []
+            for col in range(num_columns):
+                kind = col % 3
+                if kind == 0:
+                    values.append(str(rnd.randint(0, 10 ** 8)))
+                elif kind == 1:
+                    values.append("2014-{0:02d}-{1:02d}".format(rnd.randint(1, 12), rnd.randint(1, 28)))
+                else:
+                    values.append("".join(rnd.choice("abcdefgh ") for _ in range(rnd.randint(0, FIELD_WIDTH))))
+            csv_file.write(",".join(values) + "\n")
+            fixed_file.write("".join(v.ljust(FIELD_WIDTH) for v in values) + "\n")
+    return names, csv_path, fixed_path
+
+
+def measure(fn):
+    """
+    Runs fn, which returns the number of rows it handled, and returns
+    (rows, seconds). Memory is not traced, since tracing slows some code
+    paths far more than others.
+    """
+    start = time.perf_counter()
+    rows = fn()
+    return rows, time.perf_counter() - start
+
+
+def measure_memory(fn):
+    """
+    Runs fn once more with tracemalloc on and returns its peak traced bytes
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def count_rows(reader):
+    return sum(1 for _ in reader.read())
+
+
+def benchmarks(names, csv_path, fixed_path, workdir):
+    widths = [FIELD_WIDTH] * len(names)
+    loaded = {}
+
+    def csv_reader():
+        return count_rows(readers.CsvReader(csv_path))
+
+    def fixed_width_reader():
+        return count_rows(readers.FixedWidthReader(readers.file_lines(fixed_path), widths, names))
+
+    def mmap_fixed_width_reader():
+        return count_rows(readers.MmapFixedWidthReader(fixed_path, widths, names))
+
+    def load_csv():
+        ds = nailfile.DataLoader().load(readers.CsvReader(csv_path))
+        loaded['ds'] = ds
+        return ds.scalar("select count(*) from tbl")
+
+    def load_csv_memory_fast():
+        ds = nailfile.DataLoader(profile='memory-fast').load(readers.CsvReader(csv_path))
+        return ds.scalar("select count(*) from tbl")
+
+    def iterate_rows(row_type):
+        def run():
+            ds = loaded['ds']
+            ds.row_type = row_type
+            return sum(1 for _ in ds.iterquery("select * from tbl"))
+        return run
+
+    def render_html():
+        ds = loaded['ds']
+        ds.row_type = 'compact'
+        rows = ds.fetchall("select * from tbl")
+        nailfile.to_html(rows)
+        return len(rows)
+
+    def dump():
+        ds = loaded['ds']
+        ds.dump(os.path.join(workdir, "dump.sql"))
+        return ds.scalar("select count(*) from tbl")
+
+    return [
+        ("CsvReader.read", csv_reader),
+        ("FixedWidthReader.read", fixed_width_reader),
+        ("MmapFixedWidthReader.read", mmap_fixed_width_reader),
+        ("DataLoader.load csv", load_csv),
+        ("DataLoader.load csv memory-fast", load_csv_memory_fast),
+        ("DataStore.iterquery datarow", iterate_rows('datarow')),
+        ("DataStore.iterquery compact", iterate_rows('compact')),
+        ("DataStore.iterquery tuple", iterate_rows('tuple')),
+        ("to_html", render_html),
+        ("DataStore.dump", dump),
+    ]
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(row_counts, column_counts, repeat):
+    results = []
+    workdir = tempfile.mkdtemp(prefix="nailfile_bench")
+    try:
+        for num_rows in row_counts:
+            for num_columns in column_counts:
+                names, csv_path, fixed_path = generate_files(workdir, num_rows, num_columns)
+                for name, fn in benchmarks(names, csv_path, fixed_path, workdir):
+                    best = None
+                    for _ in range(repeat):
+                        rows, seconds = measure(fn)
+                        if best is None or seconds < best[1]:
+                            best = (rows, seconds)
+                    rows, seconds = best
+                    peak = measure_memory(fn)
+                    result = {
+                        "benchmark": name,
+                        "rows": num_rows,
+                        "columns": num_columns,
+                        "seconds": seconds,
+                        "rows_per_sec": rows / seconds if seconds else None,
+                        "peak_memory_bytes": peak,
+                    }
+                    results.append(result)
+                    print("{0:<34} {1:>8} rows x {2:>3} cols  {3:>12,.0f} rows/sec  {4:>12,} bytes peak".format(
+                        name, num_rows, num_columns, result["rows_per_sec"] or 0, peak))
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def compare(baseline, results):
+    """
+    Prints the change in rows per second against an earlier run
+    """
+    previous = {(r["benchmark"], r["rows"], r["columns"]): r for r in baseline["results"]}
+    print("")
+    print("compared with {0}".format(baseline.get("commit")))
+    for result in results:
+        before = previous.get((result["benchmark"], result["rows"], result["columns"]))
+        if not before or not before["rows_per_sec"] or not result["rows_per_sec"]:
+            continue
+        change = result["rows_per_sec"] / before["rows_per_sec"] - 1
+        print("{0:<34} {1:>8} rows x {2:>3} cols  {3:>+8.1%}".format(
+            result["benchmark"], result["rows"], result["columns"], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark NailFile readers, loader and queries")
+    parser.add_argument("--rows", default="10000,100000", help="comma separated row counts")
+    parser.add_argument("--columns", default="10,50", help="comma separated column counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark; the fastest is kept")
+    parser.add_argument("--output", help="file to write JSON results to")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = run([int(n) for n in args.rows.split(",")], [int(n) for n in args.columns.split(",")],
+                  args.repeat)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": nailfile.sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(json.load(infile), results)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+import sys
+from nailfile.cli import main
+
+sys.exit(main())
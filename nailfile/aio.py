@@ -0,0 +1,141 @@
+import asyncio
+import concurrent.futures
+import sqlite3
+import threading
+from nailfile.nailfile import DataStore, PreparedStatement
+
+
+class _Worker():
+    """
+    A single thread that owns one connection. Everything that touches the
+    connection runs on this thread.
+    """
+    def __init__(self, connect, row_type):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="nailfile")
+        self.busy = 0
+        self.store = None
+        self._lock = threading.Lock()
+        self._current = None
+        self.executor.submit(self._open, connect, row_type).result()
+
+    def _open(self, connect, row_type):
+        self.store = DataStore(connect(), row_type=row_type)
+
+    def run(self, job, fn, *args):
+        with self._lock:
+            self._current = job
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._current = None
+
+    def interrupt(self, job):
+        """
+        Interrupts the query running on this worker, if it belongs to job
+        """
+        with self._lock:
+            if self._current is job:
+                self.store._conn.interrupt()
+
+    def close(self):
+        self.executor.submit(self.store._conn.close).result()
+        self.executor.shutdown()
+
+
+class AsyncDataStore():
+    """
+    An asyncio front end for DataStore. Queries run on dedicated worker
+    threads, each with its own connection to database, so long scans do
+    not block the event loop. A cancelled query is stopped with
+    sqlite3.Connection.interrupt. With more than one worker, database must
+    be a file or a shared-cache URI, since every worker opens its own
+    connection. execute and commit always run on the same worker, so a
+    write is committed on the connection that made it. connect_options
+    are passed to sqlite3.connect.
+    """
+    FETCH_SIZE = 1000
+
+    def __init__(self, database, workers=1, row_type='compact', fetch_size=None, **connect_options):
+        if workers < 1:
+            raise ValueError("Invalid number of workers: {0}".format(workers))
+        self.database = database
+        self.fetch_size = fetch_size or self.FETCH_SIZE
+        connect = lambda: sqlite3.connect(database, **connect_options)
+        self._workers = [_Worker(connect, row_type) for _ in range(workers)]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def fetchall(self, sql, params=()):
+        return await self._call(lambda store: store.fetchall(sql, params))
+
+    async def fetchone(self, sql, params=()):
+        return await self._call(lambda store: store.fetchone(sql, params))
+
+    async def scalar(self, sql, params=()):
+        return await self._call(lambda store: store.scalar(sql, params))
+
+    async def execute(self, sql, params=()):
+        return await self._call(lambda store: store.execute(sql, params), self._writer)
+
+    async def commit(self):
+        return await self._call(lambda store: store.commit(), self._writer)
+
+    async def iterquery(self, sql, params=(), batch_size=None):
+        """
+        Asynchronously yields the rows of a query, fetching them from the
+        worker thread fetch_size rows at a time
+        """
+        batch_size = batch_size or self.fetch_size
+        stmt = PreparedStatement(sql, params)
+        worker = self._acquire()
+        cursor = None
+        try:
+            cursor = await self._submit(worker, lambda: worker.store._conn.cursor().execute(stmt.sql, stmt.params))
+            while True:
+                rows = await self._submit(worker, lambda: cursor.fetchmany(batch_size))
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            worker.busy -= 1
+            if cursor is not None:
+                worker.executor.submit(cursor.close)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            await loop.run_in_executor(None, worker.close)
+
+    @property
+    def _writer(self):
+        # writes and their commit must share a connection, so they all go
+        # to the first worker
+        return self._workers[0]
+
+    def _acquire(self, worker=None):
+        if worker is None:
+            worker = min(self._workers, key=lambda w: w.busy)
+        worker.busy += 1
+        return worker
+
+    async def _call(self, fn, worker=None):
+        worker = self._acquire(worker)
+        try:
+            return await self._submit(worker, lambda: fn(worker.store))
+        finally:
+            worker.busy -= 1
+
+    async def _submit(self, worker, fn):
+        job = object()
+        future = asyncio.get_running_loop().run_in_executor(worker.executor, worker.run, job, fn)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            worker.interrupt(job)
+            raise
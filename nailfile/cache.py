@@ -0,0 +1,164 @@
+import functools
+import glob
+import hashlib
+import os
+import sqlite3
+from nailfile.nailfile import DataLoader, DataStore, _content_hash, _read_only_uri
+from nailfile.readers import DataField, DataReader
+
+
+class DatasetCache():
+    """
+    An on-disk cache of loaded databases, so that loading the same file
+    with the same reader settings again opens the earlier result instead
+    of parsing the file. Entries are keyed on the input path, a fingerprint
+    of the file (size, mtime and a hash of its first and last blocks), the
+    reader's settings and the load options. Readers with a setting that
+    cannot be described, such as a lambda, need an explicit key naming
+    that setting. When the cache grows past max_bytes the least recently
+    used entries are removed.
+    """
+    MAX_BYTES = 2 * 1024 ** 3
+    EXTENSION = ".sqlite"
+
+    def __init__(self, cache_dir=None, max_bytes=None, loader=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'nailfile')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes or self.MAX_BYTES
+        self.loader = loader or DataLoader()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, reader, source_path, in_memory=False, key=None, **load_options):
+        """
+        Returns a DataStore for reader, loading it only on a cache miss.
+        source_path is the file the reader reads from. key, when given,
+        stands in for the reader's settings in the cache key; it is needed
+        when they cannot be described. On a hit the cached database is
+        opened read-only, or copied into a new :memory: database when
+        in_memory is set. load_options are passed on to DataLoader.load.
+        """
+        path = os.path.join(self.cache_dir, self.cache_key(reader, source_path, load_options, key) + self.EXTENSION)
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)
+            return self._open(path, in_memory)
+
+        self.misses += 1
+        ds = self.loader.load(reader, **load_options)
+        partial = path + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        ds.save(partial)
+        os.replace(partial, path)
+        self.evict()
+        return ds
+
+    def cache_key(self, reader, source_path, load_options=None, key=None):
+        stat = os.stat(source_path)
+        parts = [
+            os.path.abspath(source_path),
+            stat.st_size,
+            stat.st_mtime_ns,
+            _content_hash(source_path, stat.st_size),
+            ('key', key) if key is not None else _reader_signature(reader),
+            sorted((load_options or {}).items()),
+        ]
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def entries(self):
+        """
+        Returns (last used, size, path) for every cached database, least
+        recently used first
+        """
+        result = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*" + self.EXTENSION)):
+            stat = os.stat(path)
+            result.append((stat.st_mtime, stat.st_size, path))
+        result.sort()
+        return result
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for used, size, path in entries)
+        for used, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        for used, size, path in self.entries():
+            os.remove(path)
+
+    def _open(self, path, in_memory):
+        if in_memory:
+            source = sqlite3.connect(path)
+            connection = sqlite3.connect(':memory:')
+            try:
+                source.backup(connection)
+            finally:
+                source.close()
+        else:
+            connection = sqlite3.connect(_read_only_uri(path), uri=True)
+        return DataStore(connection, row_type='compact')
+
+
+# reader attributes that describe progress through a read, not its settings
+_STATE_ATTRIBUTES = {'_line_number', '_first', '_pending', '_fields_cache', '_schema_state', '_schema_version',
+                     '_replaying', '_replay_fields', '_types', '_converters', '_typed_fields', '_last_typed',
+                     '_segment_fields', 'element_separator', 'sub_element_separator', 'segment_terminator'}
+# reader attributes compiled from other settings, which are described instead
+_DERIVED_ATTRIBUTES = {'_split', '_dispatch'}
+
+
+def _reader_signature(reader):
+    """
+    A description of a reader's settings built from its attributes. A
+    ValueError is raised for a setting with no stable description, such
+    as a lambda, since leaving it out could give two different readers
+    the same key.
+    """
+    result = [type(reader).__name__]
+    for name, value in sorted(vars(reader).items()):
+        if name in _STATE_ATTRIBUTES or name in _DERIVED_ATTRIBUTES:
+            continue
+        if getattr(value, '__self__', None) is reader:
+            # a method of the reader itself, such as CsvReader.fn_get_data
+            signature = ('method', value.__func__.__qualname__)
+        else:
+            signature = _signature_value(value)
+        if signature is None:
+            raise ValueError("Cannot describe the {0} setting of {1} for a cache key; pass key= to cache it".format(
+                name, type(reader).__name__))
+        result.append((name, signature))
+    return result
+
+
+def _signature_value(value):
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return repr(value)
+    elif isinstance(value, functools.partial):
+        # a partial of a named function, such as readers.file_lines returns
+        args = _signature_value(value.args)
+        keywords = _signature_value(value.keywords)
+        if '<' in value.func.__qualname__ or args is None or keywords is None:
+            return None
+        return ('partial', value.func.__module__, value.func.__qualname__, args, keywords)
+    elif isinstance(getattr(value, '__self__', None), DataReader):
+        return ('method', value.__func__.__qualname__, _reader_signature(value.__self__))
+    elif isinstance(value, slice):
+        return ('slice', value.start, value.stop, value.step)
+    elif isinstance(value, DataField):
+        return (value.name, value.datatype)
+    elif isinstance(value, DataReader):
+        return _reader_signature(value)
+    elif isinstance(value, (list, tuple)):
+        items = [_signature_value(v) for v in value]
+        return None if None in items else tuple(items)
+    elif isinstance(value, dict):
+        items = [(repr(k), _signature_value(v)) for k, v in sorted(value.items(), key=lambda i: repr(i[0]))]
+        return None if any(v is None for k, v in items) else tuple(items)
+    return None
@@ -0,0 +1,175 @@
+"""
+Command line interface: load flat files into SQLite and stream the results
+of a query to stdout.
+
+    $> nailfile people.csv -q "select gender, count(*) from people group by gender"
+    $> nailfile --widths 5,30,1 --names num,name,gender claims.txt.gz --format jsonl --limit 100
+    $> nailfile daily/*.csv --table sales --db sales.db
+    $> nailfile --db sales.db -q "select * from sales where amount > 100" --format tsv
+"""
+import argparse
+import os
+import sys
+
+FORMATS = ('csv', 'tsv', 'jsonl')
+READERS = ('csv', 'fixed', 'x12')
+X12_EXTENSIONS = ('.834', '.835', '.837', '.270', '.271', '.276', '.277', '.278', '.edi', '.x12')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="nailfile", description="Load flat files into SQLite and query them.")
+    parser.add_argument("files", nargs="*", help="files to load; - reads from stdin")
+    parser.add_argument("-q", "--query",
+                        help="SQL to run, or a table name; defaults to every row of the only table loaded")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="csv", help="output format (default: csv)")
+    parser.add_argument("-o", "--output", help="write results to this file instead of stdout")
+    parser.add_argument("--omit-header", action="store_true", help="leave the header row out of csv and tsv output")
+    parser.add_argument("--db", help="SQLite database file to load into, or to query when no files are given; "
+                                     "files already loaded into it are skipped unless they have changed")
+
+    group = parser.add_argument_group("reader options")
+    group.add_argument("-r", "--reader", choices=READERS,
+                       help="file format; guessed from --widths and the file extension when not given")
+    group.add_argument("-d", "--delimiter", default=",", help="csv field delimiter (default: ,); use \\t for tabs")
+    group.add_argument("--no-headers", action="store_true", help="the csv files have no header row")
+    group.add_argument("--widths", help="comma separated field widths for fixed-width files")
+    group.add_argument("--names", help="comma separated field names for fixed-width files")
+    group.add_argument("--encoding", help="text encoding of the files")
+    group.add_argument("--infer-types", action="store_true", help="store numbers and dates with inferred types")
+
+    group = parser.add_argument_group("load options")
+    group.add_argument("-t", "--table", help="load every file into this table instead of a table per file")
+    group.add_argument("--source-column", help="add a column with this name holding each row's file name")
+    group.add_argument("--limit", type=int, help="load at most this many rows from each file")
+    group.add_argument("--profile", help="ingest profile name, such as memory-fast or bulk-file")
+    group.add_argument("--workers", type=int, help="number of files to read at once")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.files and not args.db:
+        parser.error("no files to load and no --db to query")
+    if args.limit is not None and args.limit < 0:
+        parser.error("--limit must not be negative")
+    if args.widths is not None:
+        try:
+            args.widths = [int(w) for w in args.widths.split(",")]
+        except ValueError:
+            parser.error("--widths must be a comma separated list of numbers")
+    if args.delimiter == "\\t":
+        args.delimiter = "\t"
+
+    # the loader and readers are only imported once the arguments are known
+    # to be good, so that --help and usage errors come back quickly
+    import sqlite3
+    from nailfile import nailfile
+
+    try:
+        ds = load(args, nailfile)
+        query = args.query or default_query(ds)
+        write_results(ds, query, args)
+    except BrokenPipeError:
+        # the reader of our output went away, as with | head; stop quietly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    except (sqlite3.Error, ValueError, OSError) as ex:
+        sys.stderr.write("nailfile: {0}\n".format(ex))
+        return 1
+    return 0
+
+
+def load(args, nailfile):
+    """
+    Loads the files named in args, or opens --db on its own, and returns
+    a DataStore. Files loaded into --db are loaded incrementally, which
+    always adds a source column and reads one file at a time.
+    """
+    if not args.files:
+        if not os.path.exists(args.db):
+            raise ValueError("No such database: {0}".format(args.db))
+        return nailfile.DataStore(nailfile.connect(args.db, read_only=True))
+
+    loader = nailfile.DataLoader(profile=args.profile)
+    factory = lambda path, table_name: make_reader(args, path, table_name)
+    if args.db and "-" not in args.files:
+        # files are fingerprinted in the database, so running the same load
+        # again does not add their rows twice; each file is loaded whole,
+        # since not every format is made of newline-terminated records
+        return loader.load_incremental(args.files, factory, connection=args.db, table_name=args.table,
+                                       source_file_field=args.source_column or "source_file",
+                                       encoding=args.encoding)
+    return loader.load_many(args.files, factory, connection=args.db, table_name=args.table,
+                            workers=args.workers, source_file_field=args.source_column)
+
+
+def make_reader(args, path, table_name):
+    """
+    Makes the reader for a file. path may also be an open text stream,
+    as load_incremental passes.
+    """
+    from nailfile import readers
+
+    source = sys.stdin if path == "-" else path
+    if hasattr(path, 'read'):
+        path = getattr(path, 'name', '')
+    kind = args.reader
+    if kind is None:
+        if args.widths:
+            kind = "fixed"
+        elif str(path).lower().endswith(X12_EXTENSIONS):
+            kind = "x12"
+        else:
+            kind = "csv"
+
+    if kind == "fixed":
+        if not args.widths:
+            raise ValueError("Fixed-width files need --widths")
+        names = args.names.split(",") if args.names else ()
+        if hasattr(source, 'read'):
+            fn_get_data = lambda: (line.rstrip('\r\n') for line in source)
+        else:
+            fn_get_data = readers.file_lines(path, encoding=args.encoding)
+        reader = readers.FixedWidthReader(fn_get_data, args.widths, names, table_name)
+    elif kind == "x12":
+        reader = readers.X12Reader(source, table_prefix=table_name + "_", encoding=args.encoding or 'latin-1')
+    else:
+        reader = readers.CsvReader(source, table_name, headers=not args.no_headers, delimiter=args.delimiter,
+                                   encoding=args.encoding)
+
+    if args.infer_types:
+        reader = readers.TypeInferenceReader(reader)
+    if args.limit is not None:
+        reader = readers.DataReaderLimiter(reader, args.limit)
+    return reader
+
+
+def default_query(ds):
+    from nailfile import nailfile
+
+    tables = [r[0] for r in ds.fetchall("select name from sqlite_master where type = 'table' "
+                                        "and name not like 'sqlite_%' and name != ? order by name",
+                                        nailfile.DataLoader.FILES_TABLE)]
+    if len(tables) != 1:
+        raise ValueError("Use --query to pick one of the tables: {0}".format(", ".join(tables)))
+    return tables[0]
+
+
+def write_results(ds, query, args):
+    """
+    Streams the results of query to --output or stdout, a batch at a time
+    """
+    target = args.output or sys.stdout
+    if args.format == "jsonl":
+        ds.export_jsonl(query, target)
+    else:
+        delimiter = "\t" if args.format == "tsv" else ","
+        ds.export_csv(query, target, delimiter=delimiter, header=not args.omit_header)
+    if target is sys.stdout:
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,22 @@
+import array
+import contextlib
+import csv
+import glob
+import hashlib
+import io
+import itertools
+import json
 import os
+import queue
+import re
 import sqlite3
+import sys
+import threading
+import time
 from collections import OrderedDict
-
-#TODO Copy memory db to file system
-#TODO: Dump sqlite database to .sql file
+from urllib.request import pathname2url
+from nailfile.readers import DataReader, DataReaderSkipper, SourceFileReader, _check_shared_fields, \
+    table_name_for_file, detect_compression, open_input, INPUT_BUFFER_SIZE
 
 
 class PreparedStatement:
@@ -40,28 +53,115 @@ class PreparedStatement:
             return "'" + str(value).replace("'", "\'") + "'"
 
 
-def to_html(datarows):
-    html = []
-    html.append("<table>")
-    header = False
-    for row in datarows:
-        if not header:
-            tr = "<tr>" + "".join(["<th>{0}</th>".format(_escape_html(f)) for f in row.fields]) + "</tr>"
-            html.append(tr)
-            header = True
-        tr = "<tr>" + "".join(["<td>{0}</td>".format(_escape_html(v)) for v in row.values]) + "</tr>"
-        html.append(tr)
-    html.append("</table>")
-    return os.linesep.join(html)
+def to_html(datarows, fields=None, max_rows=None):
+    """
+    Renders query result rows as an HTML table. Rows may be DataRow,
+    CompactRow or plain tuples; plain tuples only get a header row when
+    the column names are known, either passed in as fields or from a
+    QueryResult. See iter_html for max_rows.
+    """
+    return os.linesep.join(iter_html(datarows, fields, max_rows))
 
 
-def _escape_html(value):
-    if value:
-        result = str(value)
-        result = result.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace(" ", "&nbsp;")
+def iter_html(datarows, fields=None, max_rows=None, chunk_rows=1000):
+    """
+    Renders query result rows as an HTML table in chunks of chunk_rows
+    rows, so that large results never have to be held as one string. When
+    max_rows is given, rendering stops after that many rows and a footer
+    row says how many rows were left out, or only that there were more
+    when datarows has no len() and cannot be counted without draining it.
+    Joining the chunks with os.linesep gives the same output as to_html.
+    """
+    if fields is None:
+        fields = getattr(datarows, 'fields', None)
+    rows = iter(datarows)
+    lines = ["<table>"]
+    num_columns = len(fields) if fields is not None else 0
+    if fields is not None:
+        lines.append(_html_header(fields))
+    else:
+        first = next(rows, None)
+        if first is not None:
+            if hasattr(first, 'fields'):
+                lines.append(_html_header(first.fields))
+            num_columns = len(_row_values(first))
+            rows = itertools.chain((first,), rows)
+
+    if max_rows is not None:
+        shown = itertools.islice(rows, max_rows)
     else:
-        result = "<em>&lt;NULL&gt;</em>"
-    return result
+        shown = rows
+    for row in shown:
+        lines.append(_html_row(row))
+        if len(lines) >= chunk_rows:
+            yield os.linesep.join(lines)
+            lines = []
+
+    if max_rows is not None:
+        try:
+            remaining = len(datarows) - max_rows
+        except TypeError:
+            # a one-pass iterator is not drained just to count what is left
+            remaining = 1 if next(rows, None) is not None else 0
+            message = "more rows"
+        else:
+            message = "{0} more rows".format(remaining)
+        if remaining > 0:
+            lines.append(_html_message(message, num_columns))
+    lines.append("</table>")
+    yield os.linesep.join(lines)
+
+
+class QueryResult(list):
+    """
+    The list of rows returned by DataStore.fetchall, which also knows its
+    column names. In IPython it renders as an HTML table showing only the
+    first and last rows of large results.
+    """
+    HTML_HEAD_ROWS = 10
+    HTML_TAIL_ROWS = 10
+
+    def __init__(self, rows=(), fields=None):
+        super(QueryResult, self).__init__(rows)
+        self.fields = fields
+
+    def _repr_html_(self):
+        head, tail = self.HTML_HEAD_ROWS, self.HTML_TAIL_ROWS
+        if len(self) <= head + tail:
+            return to_html(self, self.fields)
+        lines = ["<table>"]
+        fields = self.fields
+        if fields is None and hasattr(self[0], 'fields'):
+            fields = self[0].fields
+        if fields is not None:
+            lines.append(_html_header(fields))
+        lines.extend(_html_row(row) for row in self[0:head])
+        num_columns = len(fields) if fields is not None else len(_row_values(self[0]))
+        lines.append(_html_message("&hellip; {0} more rows &hellip;".format(len(self) - head - tail), num_columns))
+        lines.extend(_html_row(row) for row in self[len(self) - tail:])
+        lines.append("</table>")
+        return os.linesep.join(lines)
+
+
+def _html_header(fields):
+    return "<tr>" + "".join(["<th>{0}</th>".format(_escape_html(f)) for f in fields]) + "</tr>"
+
+
+def _html_row(row):
+    return "<tr>" + "".join(["<td>{0}</td>".format(_escape_html(v)) for v in _row_values(row)]) + "</tr>"
+
+
+def _html_message(message, num_columns):
+    return '<tr><td colspan="{0}"><em>{1}</em></td></tr>'.format(max(num_columns, 1), message)
+
+
+_html_escapes = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", " ": "&nbsp;"})
+
+
+def _escape_html(value):
+    if value is None:
+        return "<em>&lt;NULL&gt;</em>"
+    return str(value).translate(_html_escapes)
 
 
 class DataRow():
@@ -112,15 +212,407 @@ class DataRow():
         return self.__dict__.__iter__()
 
 
+class CompactRow(tuple):
+    """
+    A lightweight, read-only row for query results. The values are stored
+    once, as a tuple, and can be read by position, by column name as a key,
+    or as attributes named for the columns. A subclass holding the column
+    names is built once per distinct result layout by compact_row_class.
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    @property
+    def fields(self):
+        return list(self._fields)
+
+    @property
+    def values(self):
+        return list(self)
+
+    def keys(self):
+        return list(self._fields)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def __getattr__(self, name):
+        index = self._index.get(name)
+        if index is None:
+            raise AttributeError(name)
+        return tuple.__getitem__(self, index)
+
+    def __str__(self):
+        return "{" + ", ".join(["{0}: {1}".format(repr(k), repr(v)) for k, v in zip(self._fields, self)]) + "}" + \
+               os.linesep
+
+    def __repr__(self):
+        return self.__str__()
+
+
+_compact_row_classes = {}
+
+
+def compact_row_class(field_names):
+    """
+    Returns the cached CompactRow subclass for a list of column names
+    """
+    key = tuple(field_names)
+    cls = _compact_row_classes.get(key)
+    if cls is None:
+        if len(_compact_row_classes) >= 1024:
+            _compact_row_classes.clear()
+        index = {}
+        for i, name in enumerate(key):
+            index[name] = i
+        cls = type('CompactRow', (CompactRow,), {'__slots__': (), '_fields': key, '_index': index})
+        _compact_row_classes[key] = cls
+    return cls
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    return numpy
+
+
+def _to_array(values):
+    """
+    Converts a list of column values to the most compact array type
+    available: a NumPy array when NumPy is installed, otherwise an
+    array.array for all-integer or all-number columns and a list for
+    anything else. With NumPy, NULLs in a numeric column become NaN.
+    """
+    numpy = _import_numpy()
+    kinds = set(map(type, values))
+    if numpy is not None:
+        if kinds and kinds <= {int}:
+            try:
+                return numpy.array(values, dtype=numpy.int64)
+            except OverflowError:
+                return numpy.array(values, dtype=object)
+        elif kinds and kinds <= {int, float, type(None)} and kinds != {type(None)}:
+            return numpy.array([numpy.nan if v is None else v for v in values], dtype=numpy.float64)
+        return numpy.array(values, dtype=object)
+    if kinds and kinds <= {int}:
+        try:
+            return array.array('q', values)
+        except OverflowError:
+            return values
+    elif kinds and kinds <= {int, float}:
+        return array.array('d', values)
+    return values
+
+
+def _content_hash(path, size, block_size=64 * 1024):
+    """
+    Hashes the first and last blocks of the first size bytes of a file,
+    which is enough to tell an appended-to file from a rewritten one
+    without reading all of it
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        digest.update(infile.read(min(size, block_size)))
+        if size > block_size:
+            infile.seek(max(block_size, size - block_size))
+            digest.update(infile.read(size - infile.tell()))
+    return digest.hexdigest()
+
+
+def _complete_length(path, size, block_size=64 * 1024):
+    """
+    Returns the length of the first size bytes of a file up to and
+    including its last newline, leaving out a last line still being
+    written
+    """
+    with open(path, 'rb') as infile:
+        end = size
+        while end > 0:
+            start = max(end - block_size, 0)
+            infile.seek(start)
+            found = infile.read(end - start).rfind(b'\n')
+            if found >= 0:
+                return start + found + 1
+            end = start
+    return 0
+
+
+class _FileRanges(io.RawIOBase):
+    """
+    A raw binary stream over the (start, end) byte ranges of a file, read
+    one after the other
+    """
+    def __init__(self, path, ranges):
+        super(_FileRanges, self).__init__()
+        self.name = path
+        self._file = open(path, 'rb')
+        self._ranges = [r for r in ranges if r[1] > r[0]]
+        if self._ranges:
+            self._file.seek(self._ranges[0][0])
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._ranges:
+            start, end = self._ranges[0]
+            position = self._file.tell()
+            if position < end:
+                with memoryview(buffer) as view:
+                    return self._file.readinto(view[0:min(len(view), end - position)])
+            self._ranges.pop(0)
+            if self._ranges:
+                self._file.seek(self._ranges[0][0])
+        return 0
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super(_FileRanges, self).close()
+
+
+def _table_names(paths, table_name=None):
+    """
+    Returns the table each file is loaded into: table_name for all of
+    them when given, otherwise a table named after each file. Different
+    files that would share a table name are an error.
+    """
+    if table_name is not None:
+        return [table_name] * len(paths)
+    names = [table_name_for_file(path) for path in paths]
+    seen = {}
+    for path, name in zip(paths, names):
+        other = seen.setdefault(name, path)
+        if os.path.abspath(other) != os.path.abspath(path):
+            raise ValueError("{0} and {1} would both load into table {2}; pass table_name or rename one".format(
+                other, path, name))
+    return names
+
+
+def _export_sql(query):
+    if re.match(r'^\w+$', query.strip()):
+        return "select * from {0}".format(query.strip())
+    return query
+
+
+@contextlib.contextmanager
+def _open_export(target, mode, **kwargs):
+    """
+    Opens a path for writing with a large buffer, or passes an already
+    open file-like object through without closing it
+    """
+    if hasattr(target, 'write'):
+        yield target
+    else:
+        with open(target, mode, buffering=DataStore.WRITE_BUFFER_SIZE, **kwargs) as outfile:
+            yield outfile
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError("Cannot export {0!r} to JSON".format(value))
+
+
+def _arrow_column(pyarrow, kinds):
+    """
+    Picks the pyarrow type for a column holding the given SQLite storage
+    classes, along with a function to convert its values first, if needed
+    """
+    if kinds == {'integer'}:
+        return pyarrow.int64(), None
+    elif kinds and kinds <= {'integer', 'real'}:
+        return pyarrow.float64(), None
+    elif kinds == {'blob'}:
+        return pyarrow.binary(), None
+    elif kinds <= {'text'}:
+        return pyarrow.string(), None
+    return pyarrow.string(), lambda values: [_export_text(v) for v in values]
+
+
+def _export_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    elif isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def _row_values(row):
+    if isinstance(row, DataRow):
+        return row.values
+    return tuple(row)
+
+
+class QueryCache():
+    """
+    An LRU cache of query results for DataStore, bounded by an estimate
+    of the memory used by the cached rows. Results are keyed on the SQL,
+    with whitespace outside of quoted strings collapsed, plus the query
+    parameters. A write through DataStore.execute drops the cached results
+    of every query that mentions the written table, or everything when the
+    write changed more rows than its own, as triggers do. Any other change to
+    the database, such as a DataLoader load or a write from another
+    connection, drops everything.
+    """
+    MAX_BYTES = 64 * 1024 * 1024
+
+    _quoted = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])""")
+    _words = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+    _write_target = re.compile(r'^(?:insert(?:\s+or\s+\w+)?\s+into|replace\s+into|update(?:\s+or\s+\w+)?|'
+                               r'delete\s+from|drop\s+table(?:\s+if\s+exists)?|alter\s+table)\s+(?:\w+\s*\.\s*)?(\w+)',
+                               re.IGNORECASE)
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or self.MAX_BYTES
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    @classmethod
+    def normalize(cls, sql):
+        parts = cls._quoted.split(sql.strip())
+        for i in range(0, len(parts), 2):
+            parts[i] = re.sub(r'\s+', ' ', parts[i])
+        return "".join(parts)
+
+    @classmethod
+    def is_read_only(cls, sql):
+        words = cls._statement_words(sql)
+        return bool(words) and words[0] in ('select', 'with', 'values') and \
+            not set(words) & {'insert', 'update', 'delete', 'replace'}
+
+    @classmethod
+    def tables(cls, sql):
+        """
+        The set of names a statement mentions, a superset of its tables
+        """
+        return set(cls._statement_words(sql))
+
+    @classmethod
+    def write_target(cls, sql):
+        """
+        The table a write statement changes, without any schema name, or
+        None when it is not known
+        """
+        match = cls._write_target.match(cls.normalize(sql))
+        return match.group(1).lower() if match else None
+
+    @classmethod
+    def _statement_words(cls, sql):
+        return [w.lower() for w in cls._words.findall("".join(cls._quoted.split(sql)[0::2]))]
+
+    def get(self, key):
+        """
+        Returns (True, result) for a cached key, or (False, None)
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[2]
+
+    def put(self, key, result, tables):
+        """
+        Caches a result along with the names it depends on, where None
+        means it depends on every table
+        """
+        size = _estimate_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        self._entries[key] = (tables, size, result)
+        self.size += size
+        while self.size > self.max_bytes:
+            old_key, (old_tables, old_size, old_result) = self._entries.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+
+    def invalidate(self, table_name=None):
+        """
+        Drops the results that depend on table_name, or all results
+        """
+        if table_name is None:
+            self._entries.clear()
+            self.size = 0
+            return
+        table_name = table_name.lower()
+        stale = [k for k, (tables, size, result) in self._entries.items() if tables is None or table_name in tables]
+        for key in stale:
+            self.size -= self._entries.pop(key)[1]
+
+    def stats(self):
+        return OrderedDict([('hits', self.hits), ('misses', self.misses), ('evictions', self.evictions),
+                            ('entries', len(self._entries)), ('size', self.size)])
+
+
+def _estimate_size(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        rows = result
+        size = sys.getsizeof(result)
+    else:
+        rows = [result]
+        size = 0
+    for row in rows:
+        size += sys.getsizeof(row)
+        if isinstance(row, DataRow):
+            size += 2 * sys.getsizeof(row.__dict__)
+        for value in _row_values(row):
+            size += sys.getsizeof(value)
+    return size
+
+
 class DataStore():
     """
-    Convenience class for interacting with SQLite
+    Convenience class for interacting with SQLite. row_type chooses what
+    query results look like: 'compact' (CompactRow, the default for new
+    connections), 'datarow' (DataRow) or 'tuple' (plain tuples).
     """
-    def __init__(self, connection=None):
+    def __init__(self, connection=None, row_type=None, cache=None):
+        """
+        cache turns on result caching for fetchall, fetchone and scalar.
+        It may be True, a memory budget in bytes, or a QueryCache.
+        """
         if connection is None:
             connection = sqlite3.connect(':memory:')
-            connection.row_factory = DataStore.datarow_factory
+            if row_type is None:
+                row_type = 'compact'
         self._conn = connection
+        if row_type is not None:
+            self.row_type = row_type
+        if cache is True:
+            cache = QueryCache()
+        elif cache is not None and cache is not False and not isinstance(cache, QueryCache):
+            cache = QueryCache(max_bytes=cache)
+        self.cache = cache or None
+        self._cache_stamp = None
+        self._cache_views = None
+        self.load_stats = None
+
+    @property
+    def row_type(self):
+        for name, factory in DataStore.ROW_FACTORIES.items():
+            if self._conn.row_factory is factory:
+                return name
+        return None
+
+    @row_type.setter
+    def row_type(self, value):
+        if value not in DataStore.ROW_FACTORIES:
+            raise ValueError("Unknown row type: {0}".format(value))
+        self._conn.row_factory = DataStore.ROW_FACTORIES[value]
 
     @staticmethod
     def datarow_factory(cursor, row):
@@ -129,6 +621,19 @@ class DataStore():
             d[col[0]] = row[idx]
         return d
 
+    _last_row_class = (None, None)
+
+    @staticmethod
+    def compact_row_factory(cursor, row):
+        # sqlite3 hands back the same description object for every row of a
+        # result, so the last layout seen is remembered by identity
+        description = cursor.description
+        last_description, cls = DataStore._last_row_class
+        if description is not last_description:
+            cls = compact_row_class([col[0] for col in description])
+            DataStore._last_row_class = (description, cls)
+        return cls(row)
+
     def iterquery(self, sql, params=()):
         stmt = PreparedStatement(sql, params)
         cur = self._conn.cursor()
@@ -136,23 +641,98 @@ class DataStore():
             yield row
 
     def execute(self, sql, params=()):
-        cur = self._execute(sql, params)
+        if self.cache is None or QueryCache.is_read_only(sql):
+            cur = self._execute(sql, params)
+        else:
+            self._check_cache_stamp()
+            changes = self._conn.total_changes
+            cur = None
+            try:
+                cur = self._execute(sql, params)
+            finally:
+                # triggers and foreign key actions change other tables too;
+                # they show up as more changes than the statement's own rows
+                target = QueryCache.write_target(sql)
+                if cur is None or target is None or self._conn.total_changes - changes > max(cur.rowcount, 0):
+                    self.cache.invalidate()
+                else:
+                    self.cache.invalidate(target)
+                self._cache_stamp = self._database_stamp()
+                self._cache_views = None
         return cur.rowcount
 
+    FETCH_SIZE = 10000
+
+    def fetch_columns(self, sql, params=(), batch_size=None):
+        """
+        Runs a query and returns an OrderedDict of column name to an array
+        of that column's values (see _to_array for the array types). Rows
+        are pulled from SQLite in fetchmany batches as plain tuples, and no
+        row objects are built.
+        """
+        names, batches = self._column_batches(sql, params, batch_size or self.FETCH_SIZE)
+        columns = [[] for _ in names]
+        for batch in batches:
+            for column, values in zip(columns, batch):
+                column.extend(values)
+        return OrderedDict(zip(names, [_to_array(c) for c in columns]))
+
+    def iter_columns(self, sql, params=(), chunk_size=None):
+        """
+        Like fetch_columns, but yields an OrderedDict of arrays for every
+        chunk_size rows so that large results never need to fit in memory
+        """
+        names, batches = self._column_batches(sql, params, chunk_size or self.FETCH_SIZE)
+        for batch in batches:
+            yield OrderedDict(zip(names, [_to_array(list(c)) for c in batch]))
+
+    def _column_batches(self, sql, params, batch_size, transpose=True):
+        """
+        Runs a query and returns its column names along with a generator of
+        fetchmany batches of plain tuples, each transposed into one tuple
+        per column unless transpose is False
+        """
+        stmt = PreparedStatement(sql, params)
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        cur.execute(stmt.sql, stmt.params)
+        names = [col[0] for col in cur.description or ()]
+
+        def batches():
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield list(zip(*rows)) if transpose else rows
+        return names, batches()
+
     def fetchall(self, sql, params=()):
-        return list(self.iterquery(sql, params))
+        if self.cache is not None:
+            result = self._cached('all', sql, params, lambda: self._fetchall(sql, params))
+            return QueryResult(result, result.fields)
+        return self._fetchall(sql, params)
+
+    def _fetchall(self, sql, params):
+        cur = self._execute(sql, params)
+        rows = cur.fetchall()
+        return QueryResult(rows, [col[0] for col in cur.description] if cur.description else None)
 
     def fetchone(self, sql, params=()):
+        if self.cache is not None:
+            return self._cached('one', sql, params, lambda: self._execute(sql, params).fetchone())
         cur = self._execute(sql, params)
         result = cur.fetchone()
         return result
 
     def scalar(self, sql, params=()):
         result = self.fetchone(sql, params)
-        if result is None or len(result) == 0:
+        if result is None:
+            return None
+        values = _row_values(result)
+        if len(values) == 0:
             return None
         else:
-            return result.values[0]
+            return values[0]
 
     def commit(self):
         self._conn.commit()
@@ -163,30 +743,169 @@ class DataStore():
 
     def column_schema(self, table_name):
         result = []
-        for row in self.fetchall("PRAGMA table_info('{0}')".format(table_name)):
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        for cid, name, datatype, notnull, dflt_value, pk in cur.execute("PRAGMA table_info('{0}')".format(table_name)):
             schema_row = DataRow()
-            schema_row.COLUMN_NAME = row['name']
-            schema_row.DATA_TYPE = row['type']
-            if row['notnull'] == '0':
+            schema_row.COLUMN_NAME = name
+            schema_row.DATA_TYPE = datatype
+            if notnull:
                 schema_row.IS_NULLABLE = "NO"
             else:
                 schema_row.IS_NULLABLE = "YES"
-            if row['dflt_value'] is None:
+            if dflt_value is None:
                 schema_row.COLUMN_DEFAULT = ""
             else:
-                schema_row.COLUMN_DEFAULT = row['dflt_value']
+                schema_row.COLUMN_DEFAULT = dflt_value
             result.append(schema_row)
         return result
 
+    def save(self, filepath, pages=-1):
+        """
+        Copies the whole database to a SQLite file using the backup API,
+        pages at a time (all at once by default)
+        """
+        target = sqlite3.connect(filepath)
+        try:
+            self._conn.backup(target, pages=pages)
+        finally:
+            target.close()
+
     def iterdump(self):
         for line in self._conn.iterdump():
             yield line
 
+    WRITE_BUFFER_SIZE = 1024 * 1024
+
     def dump(self, sqlfile):
-        with open(sqlfile, 'w') as outfile:
-            for line in self._conn.iterdump():
-                outfile.write(line)
-                outfile.write(os.linesep)
+        with open(sqlfile, 'w', buffering=self.WRITE_BUFFER_SIZE) as outfile:
+            lines = self._conn.iterdump()
+            while True:
+                chunk = list(itertools.islice(lines, self.FETCH_SIZE))
+                if not chunk:
+                    break
+                outfile.write(os.linesep.join(chunk) + os.linesep)
+
+    def export_csv(self, query, target, params=(), delimiter=",", header=True, batch_size=None):
+        """
+        Streams the results of a query, or all of a table when query is a
+        bare table name, to a csv file. target may be a path or an open
+        text file-like object. Returns the number of rows written.
+        """
+        names, batches = self._column_batches(_export_sql(query), params, batch_size or self.FETCH_SIZE,
+                                              transpose=False)
+        with _open_export(target, 'w', newline='') as outfile:
+            writer = csv.writer(outfile, delimiter=delimiter, lineterminator="\n")
+            if header:
+                writer.writerow(names)
+            count = 0
+            for batch in batches:
+                writer.writerows(batch)
+                count += len(batch)
+        return count
+
+    def export_jsonl(self, query, target, params=(), batch_size=None):
+        """
+        Streams the results of a query or table to newline-delimited JSON,
+        one object per row. Returns the number of rows written.
+        """
+        names, batches = self._column_batches(_export_sql(query), params, batch_size or self.FETCH_SIZE,
+                                              transpose=False)
+        encode = json.JSONEncoder(ensure_ascii=False, default=_json_default).encode
+        with _open_export(target, 'w') as outfile:
+            count = 0
+            for batch in batches:
+                outfile.write("".join([encode(dict(zip(names, row))) + "\n" for row in batch]))
+                count += len(batch)
+        return count
+
+    def export_parquet(self, query, target, params=(), batch_size=None):
+        """
+        Streams the results of a query or table to a Parquet file, one row
+        group per batch. Requires pyarrow. Column types come from the
+        SQLite storage classes found in the whole result, which costs one
+        extra pass of the query: integer, real and text columns keep their
+        type, and all-NULL or mixed columns are stored as strings. Returns
+        the number of rows written.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("export_parquet requires pyarrow")
+        sql = _export_sql(query)
+        names, batches = self._column_batches(sql, params, batch_size or self.FETCH_SIZE)
+        columns = [_arrow_column(pyarrow, kinds) for kinds in self._storage_classes(sql, params, len(names))]
+        schema = pyarrow.schema([(name, arrow_type) for name, (arrow_type, _) in zip(names, columns)])
+        count = 0
+        with pyarrow.parquet.ParquetWriter(target, schema) as writer:
+            for batch in batches:
+                arrays = [pyarrow.array(convert(c) if convert else c, type=arrow_type)
+                          for c, (arrow_type, convert) in zip(batch, columns)]
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                count += len(batch[0]) if batch else 0
+        return count
+
+    def _storage_classes(self, sql, params, num_columns):
+        """
+        Returns the set of SQLite storage classes (integer, real, text, blob
+        and null) found in each column of a query's results
+        """
+        if not num_columns:
+            return []
+        columns = ["c{0}".format(i) for i in range(num_columns)]
+        stmt = PreparedStatement(sql.strip().rstrip(';'), params)
+        probe = "with _export({0}) as ({1}) select {2} from _export".format(
+            ", ".join(columns), stmt.sql, ", ".join(["group_concat(distinct typeof({0}))".format(c) for c in columns]))
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        row = cur.execute(probe, stmt.params).fetchone()
+        return [set(kinds.split(",")) - {'null'} if kinds else set() for kinds in row]
+
+    def _cached(self, kind, sql, params, fn_query):
+        if not QueryCache.is_read_only(sql):
+            return fn_query()
+        key = (kind, self.row_type, QueryCache.normalize(sql), PreparedStatement.standardize_params(params))
+        try:
+            hash(key)
+        except TypeError:
+            return fn_query()
+        self._check_cache_stamp()
+        found, result = self.cache.get(key)
+        if not found:
+            result = fn_query()
+            tables = QueryCache.tables(sql)
+            if tables & self._view_names():
+                # a view can depend on any table
+                tables = None
+            self.cache.put(key, result, tables)
+        return result
+
+    def _view_names(self):
+        if self._cache_views is None:
+            cur = self._conn.cursor()
+            cur.row_factory = None
+            views = cur.execute("select name from sqlite_master where type='view'")
+            self._cache_views = set(r[0].lower() for r in views)
+        return self._cache_views
+
+    def _check_cache_stamp(self):
+        """
+        Clears the cache if the database changed in a way the cache was
+        not told about
+        """
+        stamp = self._database_stamp()
+        if stamp != self._cache_stamp:
+            self.cache.invalidate()
+            self._cache_stamp = stamp
+            self._cache_views = None
+
+    def _database_stamp(self):
+        cur = self._conn.cursor()
+        cur.row_factory = None
+        data_version = cur.execute("PRAGMA data_version").fetchone()[0]
+        schema_version = cur.execute("PRAGMA schema_version").fetchone()[0]
+        return self._conn.total_changes, data_version, schema_version
 
     def _execute(self, sql, params):
         stmt = PreparedStatement(sql, params)
@@ -196,64 +915,697 @@ class DataStore():
         return cur
 
 
+DataStore.ROW_FACTORIES = OrderedDict([
+    ('compact', DataStore.compact_row_factory),
+    ('datarow', DataStore.datarow_factory),
+    ('tuple', None),
+])
+
+
+def shared_memory_uri(name):
+    """
+    The URI of a named in-memory database that every connection in this
+    process can open with uri=True. The database lives as long as at least
+    one connection to it stays open.
+    """
+    return "file:{0}?mode=memory&cache=shared".format(name)
+
+
+def connect(database=':memory:', uri=False, wal=False, read_only=False, row_type='compact',
+            check_same_thread=True):
+    """
+    Opens a SQLite connection set up for NailFile. wal switches an on-disk
+    database to write-ahead logging so that readers are not blocked by a
+    load. read_only opens the database so that no writes are allowed.
+    """
+    if row_type not in DataStore.ROW_FACTORIES:
+        raise ValueError("Unknown row type: {0}".format(row_type))
+    if read_only and not uri and database != ':memory:':
+        database = _read_only_uri(database)
+        uri = True
+    connection = sqlite3.connect(database, uri=uri, check_same_thread=check_same_thread)
+    if wal:
+        connection.execute("PRAGMA journal_mode = WAL").fetchall()
+    if read_only:
+        connection.execute("PRAGMA query_only = 1")
+    connection.row_factory = DataStore.ROW_FACTORIES[row_type]
+    return connection
+
+
+def _read_only_uri(path):
+    """
+    A SQLite URI that opens a database file read-only. The path is quoted
+    so that characters such as # and ? stay part of the file name.
+    """
+    return "file:{0}?mode=ro".format(pathname2url(os.path.abspath(path)))
+
+
+class DataStorePool():
+    """
+    A thread-safe pool of read-only DataStores over one database, so that
+    several threads can query the same loaded data at once. database should
+    be an on-disk database (ideally in WAL mode) or a shared_memory_uri with
+    uri=True. Connections are opened as needed, up to size. Once closed,
+    the pool hands out no more DataStores.
+    """
+    def __init__(self, database, size=4, uri=False, row_type='compact'):
+        if size < 1:
+            raise ValueError("Invalid pool size: {0}".format(size))
+        self.database = database
+        self.size = size
+        self.uri = uri
+        self.row_type = row_type
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._all = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def datastore(self, timeout=None):
+        """
+        Checks a DataStore out of the pool for the duration of a with block
+        """
+        ds = self._acquire(timeout)
+        try:
+            yield ds
+        finally:
+            with self._lock:
+                # a DataStore given back after close() was closed with the pool
+                if not self._closed:
+                    if ds._conn.in_transaction:
+                        ds._conn.rollback()
+                    self._idle.put(ds)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for ds in self._all:
+                ds._conn.close()
+            self._all = []
+            self._opened = 0
+            while not self._idle.empty():
+                self._idle.get_nowait()
+
+    def _acquire(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._closed:
+                raise ValueError("The DataStorePool is closed")
+            if self._opened < self.size:
+                self._opened += 1
+                conn = connect(self.database, uri=self.uri, read_only=True, row_type=self.row_type,
+                               check_same_thread=False)
+                ds = DataStore(conn)
+                self._all.append(ds)
+                return ds
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No DataStore available in the pool")
+
+
+class IngestProfile():
+    """
+    The SQLite settings DataLoader uses while a load is running. Each
+    PRAGMA left as None is not touched. Rows are written in one explicit
+    transaction per transaction_size rows, and every PRAGMA changed for
+    the load is put back to its prior value before load() returns.
+    """
+    PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'temp_store', 'locking_mode')
+
+    def __init__(self, transaction_size=None, journal_mode=None, synchronous=None, cache_size=None,
+                 temp_store=None, locking_mode=None):
+        if transaction_size is not None and transaction_size < 1:
+            raise ValueError("Invalid transaction size: {0}".format(transaction_size))
+        self.transaction_size = transaction_size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.temp_store = temp_store
+        self.locking_mode = locking_mode
+
+    def settings(self):
+        return OrderedDict((p, getattr(self, p)) for p in self.PRAGMAS if getattr(self, p) is not None)
+
+    def apply(self, connection):
+        """
+        Applies the profile to the connection and returns the prior
+        values so that they can be passed to restore()
+        """
+        prior = OrderedDict()
+        cur = connection.cursor()
+        cur.row_factory = None
+        for pragma, value in self.settings().items():
+            prior[pragma] = cur.execute("PRAGMA {0}".format(pragma)).fetchone()[0]
+            cur.execute("PRAGMA {0} = {1}".format(pragma, value)).fetchall()
+        return prior
+
+    def restore(self, connection, prior):
+        cur = connection.cursor()
+        cur.row_factory = None
+        for pragma, value in prior.items():
+            cur.execute("PRAGMA {0} = {1}".format(pragma, value)).fetchall()
+        if 'locking_mode' in prior:
+            # an exclusive lock is only released on the next access to the database
+            cur.execute("PRAGMA schema_version").fetchall()
+
+
+# Presets usable by name with DataLoader(profile=...)
+#   default       - SQLite defaults, one transaction per DataLoader.CHUNK_SIZE rows
+#   memory-fast   - for :memory: or throwaway databases; no journal, no syncing
+#   bulk-file     - for building a new database file that can be rebuilt on failure
+#   durable-file  - WAL journaling for on-disk databases that must survive a crash
+INGEST_PROFILES = {
+    'default': IngestProfile(),
+    'memory-fast': IngestProfile(transaction_size=100000, journal_mode='OFF', synchronous='OFF',
+                                 cache_size=-262144, temp_store='MEMORY', locking_mode='EXCLUSIVE'),
+    'bulk-file': IngestProfile(transaction_size=100000, journal_mode='MEMORY', synchronous='OFF',
+                               cache_size=-262144, temp_store='MEMORY', locking_mode='EXCLUSIVE'),
+    'durable-file': IngestProfile(transaction_size=50000, journal_mode='WAL', synchronous='NORMAL',
+                                  cache_size=-65536, temp_store='MEMORY'),
+}
+
+
+class IndexAdvisor():
+    """
+    Gathers cardinality statistics for each column from the first rows
+    of a load and recommends the most selective columns for indexing.
+    A column is recommended when it has at least two distinct values,
+    its distinct/non-null ratio is at least min_selectivity, and its
+    values are short enough to be lookup keys rather than free text.
+    """
+    SAMPLE_SIZE = 10000
+    MIN_SELECTIVITY = 0.01
+    MAX_INDEXES = 4
+    MAX_KEY_LENGTH = 64
+
+    def __init__(self, sample_size=None, min_selectivity=None, max_indexes=None):
+        self.sample_size = sample_size or self.SAMPLE_SIZE
+        self.min_selectivity = min_selectivity if min_selectivity is not None else self.MIN_SELECTIVITY
+        self.max_indexes = max_indexes or self.MAX_INDEXES
+        self._tables = OrderedDict()
+
+    def observe(self, table_name, fields, row):
+        stats = self._tables.get(table_name)
+        if stats is None:
+            stats = self._tables[table_name] = [0, OrderedDict()]
+        if stats[0] >= self.sample_size:
+            return
+        stats[0] += 1
+        columns = stats[1]
+        for field, value in zip(fields, row):
+            if value is None:
+                continue
+            column = columns.get(field.name)
+            if column is None:
+                column = columns[field.name] = [set(), 0, 0]
+            column[0].add(value)
+            column[1] += 1
+            column[2] += len(str(value))
+
+    def statistics(self):
+        """
+        Returns table -> column -> (distinct values, non-null values, selectivity)
+        for the sampled rows
+        """
+        result = OrderedDict()
+        for table_name, (num_rows, columns) in self._tables.items():
+            result[table_name] = OrderedDict()
+            for name, (distinct, nonnull, total_length) in columns.items():
+                result[table_name][name] = (len(distinct), nonnull, len(distinct) / float(nonnull))
+        return result
+
+    def recommend(self):
+        """
+        Returns table -> list of column names to index, most selective first
+        """
+        result = OrderedDict()
+        for table_name, (num_rows, columns) in self._tables.items():
+            candidates = []
+            for name, (distinct, nonnull, total_length) in columns.items():
+                selectivity = len(distinct) / float(nonnull)
+                if len(distinct) > 1 and selectivity >= self.min_selectivity and \
+                        total_length / float(nonnull) <= self.MAX_KEY_LENGTH:
+                    candidates.append((selectivity, name))
+            candidates.sort(key=lambda c: -c[0])
+            result[table_name] = [name for selectivity, name in candidates[0:self.max_indexes]]
+        return result
+
+
+class LoadStats():
+    """
+    Instrumentation for one DataLoader.load. Time is split into stages:
+    read (waiting on the reader), convert (building rows for SQLite),
+    schema (create and alter table), insert, commit and index. Stage
+    times come from laps, so each second is counted in exactly one stage.
+    """
+    STAGES = ('read', 'convert', 'schema', 'insert', 'commit', 'index')
+
+    def __init__(self):
+        self.stage_seconds = OrderedDict((stage, 0.0) for stage in self.STAGES)
+        self.table_rows = OrderedDict()
+        self.rows = 0
+        self.alter_count = 0
+        self.index_build_times = OrderedDict()
+        self.started = time.perf_counter()
+        self.finished = None
+        self._mark = self.started
+
+    def lap(self, stage):
+        """
+        Adds the time since the last lap to stage and returns the current time
+        """
+        now = time.perf_counter()
+        self.stage_seconds[stage] += now - self._mark
+        self._mark = now
+        return now
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def rows_per_sec(self, table_name=None):
+        rows = self.rows if table_name is None else self.table_rows.get(table_name, 0)
+        elapsed = self.elapsed
+        return rows / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return OrderedDict([
+            ('rows', self.rows),
+            ('elapsed', self.elapsed),
+            ('rows_per_sec', self.rows_per_sec()),
+            ('stage_seconds', OrderedDict(self.stage_seconds)),
+            ('table_rows', OrderedDict(self.table_rows)),
+            ('table_rows_per_sec', OrderedDict((t, self.rows_per_sec(t)) for t in self.table_rows)),
+            ('alter_count', self.alter_count),
+            ('index_build_times', OrderedDict(self.index_build_times)),
+        ])
+
+    def __repr__(self):
+        stages = ", ".join("{0}={1:.3f}s".format(k, v) for k, v in self.stage_seconds.items())
+        return "LoadStats(rows={0}, rows_per_sec={1:.0f}, alters={2}, {3})".format(
+            self.rows, self.rows_per_sec(), self.alter_count, stages)
+
+
 class DataLoader():
     CHUNK_SIZE = 10000
+    BATCH_SIZE = 1000
+    WORKERS = 4
 
-    def __init__(self):
-        pass
+    PROGRESS_INTERVAL = 1.0
 
-    def load(self, reader, connection=None, auto_number_field="row_id", record_number_field="line_num"):
+    def __init__(self, batch_size=None, profile=None, instrument=False, progress=None, progress_interval=None):
+        """
+        batch_size controls how many consecutive rows sharing the same table
+        and field layout are sent to SQLite in a single executemany call.
+        profile is an IngestProfile or the name of one in INGEST_PROFILES.
+        instrument collects a LoadStats for each load, left in stats and
+        in the load_stats of the returned DataStore. progress, which turns
+        on instrument, is called with the LoadStats at most once every
+        progress_interval seconds while loading, and once when done.
+        """
+        self.batch_size = batch_size or self.BATCH_SIZE
+        if self.batch_size < 1:
+            raise ValueError("Invalid batch size: {0}".format(batch_size))
+        if profile is None:
+            profile = 'default'
+        if not isinstance(profile, IngestProfile):
+            if profile not in INGEST_PROFILES:
+                raise ValueError("Unknown ingest profile: {0}".format(profile))
+            profile = INGEST_PROFILES[profile]
+        self.profile = profile
+        self.progress = progress
+        self.progress_interval = progress_interval if progress_interval is not None else self.PROGRESS_INTERVAL
+        self.instrument = instrument or progress is not None
+        self.stats = None
+
+    def load(self, reader, connection=None, auto_number_field="row_id", record_number_field="line_num",
+             indexes=None):
+        """
+        Loads every row from reader into SQLite and returns a DataStore.
+        indexes may be a dict of table name to a list of columns (or tuples
+        of columns for compound indexes), an IndexAdvisor, or "auto" to let
+        a default IndexAdvisor pick columns from statistics gathered while
+        reading. Indexes are built after all rows are loaded, followed by
+        ANALYZE, and the seconds spent per table are left in index_build_times.
+        connection may be a sqlite3 connection, a database path or URI (see
+        connect and shared_memory_uri), or None for a private :memory: database.
+        """
         if connection is None:
-            connection = sqlite3.connect(':memory:')
-            connection.row_factory = DataStore.datarow_factory
+            connection = connect()
+        elif isinstance(connection, str):
+            connection = connect(connection, uri=connection.startswith("file:"))
+
+        advisor = None
+        if indexes == "auto":
+            advisor = IndexAdvisor()
+        elif isinstance(indexes, IndexAdvisor):
+            advisor = indexes
+        elif indexes is not None and not isinstance(indexes, dict):
+            raise ValueError("Invalid index specification: {0}".format(indexes))
+        self.index_build_times = OrderedDict()
+        stats = self.stats = LoadStats() if self.instrument else None
+
+        # take over transaction handling for the duration of the load
+        connection.commit()
+        isolation_level = connection.isolation_level
+        prior = self.profile.apply(connection)
+        connection.isolation_level = None
+        try:
+            self.loaded_tables = self._load_rows(reader, connection, auto_number_field, record_number_field,
+                                                 advisor)
+            if advisor is not None:
+                indexes = advisor.recommend()
+            if indexes:
+                self._build_indexes(connection, indexes)
+        finally:
+            if connection.in_transaction:
+                connection.execute("rollback")
+            connection.isolation_level = isolation_level
+            self.profile.restore(connection, prior)
+        ds = DataStore(connection)
+        if stats is not None:
+            stats.finished = time.perf_counter()
+            if self.progress is not None:
+                self.progress(stats)
+            ds.load_stats = stats
+        return ds
+
+    FILES_TABLE = "nailfile_files"
+
+    def load_incremental(self, paths, reader_factory, connection=None, auto_number_field="row_id",
+                         record_number_field="line_num", source_file_field="source_file", encoding=None,
+                         table_name=None, complete_lines=False):
+        """
+        Loads a set of files into one database, doing only the work needed
+        since the last call against the same database. reader_factory is
+        called with an open text stream of each file, decoded with encoding,
+        and a table name, and returns a reader for it. Each file gets a
+        table named after it unless table_name is given, as with load_many.
+        A fingerprint of each file (the bytes loaded, mtime and a hash of
+        their first and last blocks) is kept in the FILES_TABLE table, but
+        only when its reader was read to the end; a load cut short, as by
+        DataReaderLimiter, is done again next time. Unchanged files are
+        skipped and any other changed file has its rows deleted and is
+        loaded again.
+
+        complete_lines is for files of newline-terminated records that are
+        still being written to, such as logs. Only their complete lines are
+        loaded, so a last line with no newline yet is left for a later
+        call, and files that have only grown get their new lines appended
+        by seeking past the bytes already loaded. When appending, the
+        stream starts with the file's first line, so that a header is read
+        again, and that line is then skipped. Compressed files cannot be
+        appended to and are loaded again whenever they change.
+
+        Every row gets a source_file_field column so the rows of each file
+        can be found. What happened to each file is left in
+        incremental_report.
+        """
+        if connection is None:
+            connection = connect()
+        elif isinstance(connection, str):
+            connection = connect(connection, uri=connection.startswith("file:"))
+        cur = connection.cursor()
+        cur.row_factory = None
+        cur.execute("create table if not exists {0} (path text primary key, size integer, mtime real, "
+                    "content_hash text, line_number integer, tables text)".format(self.FILES_TABLE))
+        connection.commit()
+
+        paths = list(paths)
+        self.incremental_report = OrderedDict()
+        for path, file_table_name in zip(paths, _table_names(paths, table_name)):
+            source = os.path.abspath(path)
+            stat = os.stat(source)
+            compressed = detect_compression(source) is not None
+            if complete_lines and not compressed:
+                size = _complete_length(source, stat.st_size)
+            else:
+                size = stat.st_size
+            stored = cur.execute("select size, mtime, content_hash, line_number, tables from {0} "
+                                 "where path = ?".format(self.FILES_TABLE), (source,)).fetchone()
+            tables = []
+            resume = None
+            finished = True
+            if stored is None:
+                action = "loaded"
+            else:
+                # size is NULL when the last load did not read the whole file
+                loaded_size, mtime, content_hash, line_number, tables = stored
+                tables = tables.split(",") if tables else []
+                if loaded_size is None:
+                    unchanged = grown = False
+                else:
+                    unchanged = size == loaded_size and (stat.st_mtime == mtime or
+                                                         _content_hash(source, size) == content_hash)
+                    grown = (complete_lines and not compressed and size > loaded_size and
+                             _content_hash(source, loaded_size) == content_hash)
+                if unchanged:
+                    action = "skipped"
+                elif grown:
+                    action = "appended"
+                    if loaded_size:
+                        resume = (loaded_size, line_number)
+                else:
+                    action = "reloaded"
+                    for loaded_table in tables:
+                        cur.execute("delete from {0} where {1} = ?".format(loaded_table, source_file_field),
+                                    (source,))
+                    connection.commit()
+                    tables = []
+
+            if action != "skipped":
+                with self._open_incremental(source, size, resume, compressed, encoding) as stream:
+                    reader = reader_factory(stream, file_table_name)
+                    if resume is not None:
+                        reader = DataReaderSkipper(reader, 1, resume[1] - 1)
+                    reader = SourceFileReader(reader, source, source_file_field)
+                    self.load(reader, connection, auto_number_field, record_number_field)
+                    finished = not stream.read(1)
+                tables = tables + [t for t in self.loaded_tables if t not in tables]
+                line_number = reader.line_number
+            if finished:
+                fingerprint = (size, _content_hash(source, size), line_number)
+            else:
+                fingerprint = (None, None, None)
+            cur.execute("insert or replace into {0} (path, size, mtime, content_hash, line_number, tables) "
+                        "values (?, ?, ?, ?, ?, ?)".format(self.FILES_TABLE),
+                        (source, fingerprint[0], stat.st_mtime, fingerprint[1], fingerprint[2], ",".join(tables)))
+            connection.commit()
+            self.incremental_report[source] = action
+        return DataStore(connection)
+
+    def _open_incremental(self, source, size, resume, compressed, encoding):
+        """
+        Opens the part of a file that load_incremental reads: the whole of
+        a compressed file, the first size bytes of a plain one, or when
+        resume gives the bytes already loaded, the first line followed by
+        the lines after them
+        """
+        if compressed:
+            return open_input(source, encoding=encoding, newline='')
+        if resume is None:
+            ranges = [(0, size)]
+        else:
+            with open(source, 'rb') as infile:
+                first_line = len(infile.readline())
+            ranges = [(0, first_line), (resume[0], size)]
+        buffered = io.BufferedReader(_FileRanges(source, ranges), INPUT_BUFFER_SIZE)
+        return io.TextIOWrapper(buffered, encoding=encoding, newline='')
 
+    def load_many(self, paths, reader_factory, connection=None, table_name=None, workers=None,
+                  auto_number_field="row_id", record_number_field="line_num", source_file_field="source_file",
+                  indexes=None):
+        """
+        Loads many files into one database. paths may be a list of paths or
+        a glob pattern. reader_factory is called with a path and a table
+        name and returns a reader for that file. Each file gets a table
+        named after it unless table_name is given, in which case every file
+        is loaded into that one table. Files whose names give the same
+        table name are an error. The readers run in a pool of worker
+        threads and pass their rows in batches through a bounded queue to a
+        single load on connection. Every row gets a source_file_field column
+        naming the file it came from. The files loaded are left in
+        loaded_files; the other options are the same as for load.
+        """
+        if isinstance(paths, str):
+            pattern = paths
+            paths = sorted(glob.glob(pattern))
+            if not paths:
+                raise ValueError("No files match {0}".format(pattern))
+        paths = list(paths)
+        reader = _QueuedReader(paths, reader_factory, table_name, source_file_field, workers or self.WORKERS,
+                               self.batch_size)
+        ds = self.load(reader, connection, auto_number_field, record_number_field, indexes)
+        self.loaded_files = paths
+        return ds
+
+    def _build_indexes(self, connection, indexes):
+        cur = connection.cursor()
+        for table_name, columns in indexes.items():
+            start = time.time()
+            cur.execute("begin")
+            for column in columns:
+                if isinstance(column, str):
+                    column = (column,)
+                index_name = "ix_{0}_{1}".format(table_name, "_".join(column))
+                cur.execute("create index if not exists {0} on {1} ({2})".format(index_name, table_name,
+                                                                                 ", ".join(column)))
+            cur.execute("commit")
+            self.index_build_times[table_name] = time.time() - start
+        cur.execute("analyze")
+        if self.stats is not None:
+            self.stats.index_build_times.update(self.index_build_times)
+            self.stats.lap('index')
+
+    def _load_rows(self, reader, connection, auto_number_field, record_number_field, advisor=None):
+        transaction_size = self.profile.transaction_size or self.CHUNK_SIZE
         tables = {}
-        rownum = -1
+        statements = {}
+        pending = {}
+        rownum = 0
+        stats = self.stats
+        last_progress = stats.started if stats is not None else None
         cur = connection.cursor()
+        cur.execute("begin")
 
+        schema_version = None
         for row in reader.read():
-            rownum += 1
-            tbl = reader.table_name
-            fields = reader.fields
-            num_fields = len(fields)
-            num_values = len(row)
+            if stats is not None:
+                stats.lap('read')
 
-            # create the table if we have not encountered it yet
-            if not tables.get(tbl):
-                tables[tbl] = num_fields
-                self._create_table(reader, cur, tbl, auto_number_field, record_number_field)
-
-            # add any new columns
-            prior_field_cnt = tables[tbl]
-            if prior_field_cnt != num_fields:
-                for field in fields[prior_field_cnt:]:
-                    alter = "alter table {0} add column {1} {2}".format(tbl, field.name, field.datatype)
-                    cur.execute(alter)
-                tables[tbl] = num_fields
-
-            field_names = [f.name for f in fields[0:num_values]]
-            params = []
-            if record_number_field:
-                field_names.insert(0, record_number_field)
-                params.insert(0, reader.line_number)
-            insert = "insert into {0} ({1}) values ({2})".format(reader.table_name,
-                                                                 ", ".join(field_names),
-                                                                 ", ".join(["?"] * len(field_names)))
+            # table and column bookkeeping is only needed when the reader
+            # reports a new schema: a table switch or a change to its fields
+            if reader.schema_version != schema_version:
+                schema_version = reader.schema_version
+                tbl = reader.table_name
+                fields = reader.fields
+                names = tuple(f.name for f in fields)
+                num_fields = len(fields)
+
+                # create the table if we have not encountered it yet
+                if tbl not in tables:
+                    if stats is not None:
+                        stats.lap('convert')
+                        stats.table_rows[tbl] = 0
+                    columns = self._existing_columns(cur, tbl)
+                    if columns is None:
+                        self._create_table(reader, cur, tbl, auto_number_field, record_number_field)
+                        tables[tbl] = [num_fields, set(f.name for f in fields)]
+                    else:
+                        tables[tbl] = [0, columns]
+                    if stats is not None:
+                        stats.lap('schema')
+
+                # add any new columns
+                table = tables[tbl]
+                if table[0] != num_fields:
+                    self._flush_table(cur, pending, tbl)
+                    for field in fields[table[0]:]:
+                        if field.name not in table[1]:
+                            alter = "alter table {0} add column {1} {2}".format(tbl, field.name, field.datatype)
+                            cur.execute(alter)
+                            table[1].add(field.name)
+                            if stats is not None:
+                                stats.alter_count += 1
+                    table[0] = num_fields
+                    if stats is not None:
+                        stats.lap('schema')
+                batch = pending.get(tbl)
+                if batch is not None and batch[3] != names[0:batch[0]]:
+                    self._flush_table(cur, pending, tbl)
+                    batch = None
+
+            # each table has one pending batch, which is sent whenever the
+            # table's row layout changes so rows keep their order in the table
             num_values = len(row)
-            for i in range(0, num_values):
-                if i < num_values:
-                    params.append(row[i])
-                else:
-                    params.append(None)
+            if batch is None or batch[0] != num_values:
+                self._flush_table(cur, pending, tbl)
+                key = (tbl, names[0:num_values])
+                sql = statements.get(key)
+                if sql is None:
+                    sql = self._insert_sql(tbl, fields[0:num_values], record_number_field)
+                    statements[key] = sql
+                batch = pending[tbl] = [num_values, sql, [], key[1]]
 
-            if rownum % self.CHUNK_SIZE == 0:
-                connection.commit()
+            if advisor is not None:
+                advisor.observe(tbl, fields, row)
+
+            rows = batch[2]
+            if record_number_field:
+                rows.append((reader.line_number,) + tuple(row))
+            else:
+                rows.append(tuple(row))
 
-            cur.execute(insert, tuple(params))
             rownum += 1
+            if len(rows) >= self.batch_size:
+                self._flush(cur, batch[1], rows)
+            if rownum % transaction_size == 0:
+                for name in pending:
+                    self._flush_table(cur, pending, name)
+                self._commit(cur)
+                cur.execute("begin")
 
-        #cur.execute("COMMIT")
-        return DataStore(connection)
+            if stats is not None:
+                stats.rows = rownum
+                stats.table_rows[tbl] += 1
+                now = stats.lap('convert')
+                if self.progress is not None and now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    self.progress(stats)
+
+        for tbl in pending:
+            self._flush_table(cur, pending, tbl)
+        self._commit(cur)
+        return list(tables)
+
+    def _commit(self, cursor):
+        if self.stats is not None:
+            self.stats.lap('convert')
+        cursor.execute("commit")
+        if self.stats is not None:
+            self.stats.lap('commit')
+
+    def _existing_columns(self, cursor, table_name):
+        """
+        Returns the set of column names of an existing table, or None if
+        there is no such table
+        """
+        cur = cursor.connection.cursor()
+        cur.row_factory = None
+        columns = set(row[1] for row in cur.execute("PRAGMA table_info('{0}')".format(table_name)))
+        if not columns:
+            return None
+        return columns
+
+    def _insert_sql(self, table_name, fields, record_number_field):
+        field_names = [f.name for f in fields]
+        if record_number_field:
+            field_names.insert(0, record_number_field)
+        return "insert into {0} ({1}) values ({2})".format(table_name,
+                                                          ", ".join(field_names),
+                                                          ", ".join(["?"] * len(field_names)))
+
+    def _flush_table(self, cursor, pending, table_name):
+        batch = pending.get(table_name)
+        if batch is not None:
+            self._flush(cursor, batch[1], batch[2])
+
+    def _flush(self, cursor, sql, batch):
+        """
+        Sends any pending rows to the database and empties the batch
+        """
+        if batch:
+            if self.stats is not None:
+                self.stats.lap('convert')
+            cursor.executemany(sql, batch)
+            del batch[:]
+            if self.stats is not None:
+                self.stats.lap('insert')
 
     def _create_table(self, reader, cursor, table_name, auto_number_field, record_number_field):
         fields = []
@@ -267,6 +1619,113 @@ class DataLoader():
         cursor.execute(sql)
 
 
+class _QueuedReader(DataReader):
+    """
+    A data reader that runs a reader for each of several files on worker
+    threads and yields their rows as they arrive. Workers send batches of
+    rows, each with the table and fields they belong to, through a bounded
+    queue, so a slow consumer holds back the workers instead of letting
+    rows pile up in memory. Rows from one file keep their order.
+    """
+    _DONE = object()
+
+    def __init__(self, paths, reader_factory, table_name, source_file_field, workers, batch_size):
+        super(_QueuedReader, self).__init__()
+        if workers < 1:
+            raise ValueError("Invalid number of workers: {0}".format(workers))
+        self.paths = paths
+        self.table_names = dict(zip(paths, _table_names(paths, table_name)))
+        self.reader_factory = reader_factory
+        self.source_file_field = source_file_field
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def read(self):
+        batches = queue.Queue(maxsize=self.workers * 4)
+        stop = threading.Event()
+        paths = queue.Queue()
+        for path in self.paths:
+            paths.put(path)
+        threads = [threading.Thread(target=self._work, args=(paths, batches, stop), daemon=True)
+                   for _ in range(min(self.workers, len(self.paths)))]
+        for thread in threads:
+            thread.start()
+
+        table_fields = {}
+        running = len(threads)
+        try:
+            while running:
+                item = batches.get()
+                if item is self._DONE:
+                    running -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                path, table_name, fields, rows = item
+                if fields is not self._fields or table_name != self._table_name:
+                    _check_shared_fields(table_fields, table_name, fields, path)
+                    self._table_name = table_name
+                    self._fields = fields
+                for line_number, row in rows:
+                    self._line_number = line_number
+                    yield row
+        finally:
+            stop.set()
+            while any(thread.is_alive() for thread in threads):
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def _work(self, paths, batches, stop):
+        try:
+            while not stop.is_set():
+                try:
+                    path = paths.get_nowait()
+                except queue.Empty:
+                    break
+                self._read_file(path, batches, stop)
+        except Exception as ex:
+            self._put(batches, stop, ex)
+        finally:
+            self._put(batches, stop, self._DONE)
+
+    def _read_file(self, path, batches, stop):
+        table_name = self.table_names[path]
+        reader = self.reader_factory(path, table_name)
+        if self.source_file_field:
+            reader = SourceFileReader(reader, path, self.source_file_field)
+        schema_version = None
+        rows = []
+        for row in reader.read():
+            if reader.schema_version != schema_version:
+                if rows:
+                    self._put(batches, stop, (path, table_name, fields, rows))
+                    rows = []
+                schema_version = reader.schema_version
+                table_name = reader.table_name
+                fields = reader.fields
+            rows.append((reader.line_number, row))
+            if len(rows) >= self.batch_size:
+                if not self._put(batches, stop, (path, table_name, fields, rows)):
+                    return
+                rows = []
+        if rows:
+            self._put(batches, stop, (path, table_name, fields, rows))
+
+    def _put(self, batches, stop, item):
+        """
+        Puts item on the queue, giving up if the consumer has stopped
+        """
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
 if __name__ == '__main__':
-    pass
-    #TODO make command line interface
+    from nailfile.cli import main
+    sys.exit(main())
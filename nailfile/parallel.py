@@ -0,0 +1,186 @@
+import collections
+import csv
+import io
+import multiprocessing
+import os
+from nailfile.readers import DataReader, CsvReader, FixedWidthReader, _reject_compressed
+
+
+def record_ranges(filepath, start=0, chunk_size=8 * 1024 * 1024):
+    """
+    Splits a file into (start, end) byte ranges of roughly chunk_size bytes,
+    with every range ending just after a newline so that no record is cut
+    """
+    size = os.path.getsize(filepath)
+    ranges = []
+    with open(filepath, 'rb') as infile:
+        pos = start
+        while pos < size:
+            end = pos + chunk_size
+            if end >= size:
+                end = size
+            else:
+                infile.seek(end)
+                infile.readline()
+                end = infile.tell()
+            ranges.append((pos, end))
+            pos = end
+    return ranges
+
+
+def _read_range(filepath, start, end, encoding):
+    with open(filepath, 'rb') as infile:
+        infile.seek(start)
+        return infile.read(end - start).decode(encoding)
+
+
+def _parse_csv_range(task):
+    filepath, start, end, encoding, delimiter = task
+    text = _read_range(filepath, start, end, encoding)
+    stream = io.StringIO(text, newline='')
+    reader = CsvReader(stream, headers=False, delimiter=delimiter)
+    rows = []
+    last_start = pos = 0
+    for row in reader.read():
+        rows.append(row)
+        last_start, pos = pos, stream.tell()
+    if rows:
+        _check_quotes_closed(text[last_start:], delimiter, filepath, end)
+    return rows
+
+
+def _check_quotes_closed(record, delimiter, filepath, end):
+    """
+    Raises ValueError if the last record of a range ends inside a quoted
+    field, meaning a quoted newline was split across two ranges
+    """
+    try:
+        list(csv.reader(io.StringIO(record, newline=''), delimiter=delimiter, strict=True))
+    except csv.Error as ex:
+        if "end of data" in str(ex):
+            raise ValueError("A quoted field runs past byte {0} of {1}; parallel readers cannot read csv "
+                             "files with newlines inside quoted fields".format(end, filepath))
+
+
+def _parse_fixed_width_range(task):
+    filepath, start, end, encoding, widths, remainder_field_name, strip_values = task
+    # newline=None gives the same universal newline handling as open(), and
+    # line endings are dropped as file_lines does
+    lines = (line.rstrip('\r\n') for line in io.StringIO(_read_range(filepath, start, end, encoding), newline=None))
+    reader = FixedWidthReader(lambda: lines, widths, remainder_field_name=remainder_field_name,
+                              strip_values=strip_values)
+    return list(reader.read())
+
+
+class ParallelReader(DataReader):
+    """
+    A base class for readers that split a file into byte ranges aligned
+    to line boundaries and parse the ranges in a pool of worker processes.
+    Parsed ranges are streamed back in file order, so line_number and row
+    order are the same as for the equivalent single process reader. Only
+    a few ranges per worker are in flight at a time, which keeps memory
+    bounded when the consumer is slower than the parsers.
+    """
+    CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, filepath, processes=None, chunk_size=None, encoding='utf-8'):
+        super(ParallelReader, self).__init__()
+        if hasattr(filepath, 'read'):
+            raise ValueError("Parallel readers need a file path, not a file-like object")
+        _reject_compressed(filepath, type(self).__name__)
+        self.filepath = filepath
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.encoding = encoding
+        self._data_start = 0
+        self._first_line_number = 0
+
+    def read(self):
+        self._line_number = self._first_line_number
+        tasks = [self._task(s, e) for s, e in record_ranges(self.filepath, self._data_start, self.chunk_size)]
+        if self.processes == 1 or len(tasks) <= 1:
+            for task in tasks:
+                for row in self._yield_rows(self._worker(task)):
+                    yield row
+            return
+
+        with multiprocessing.Pool(self.processes) as pool:
+            pending = collections.deque()
+            tasks = collections.deque(tasks)
+            while tasks and len(pending) < self.processes * 2:
+                pending.append(pool.apply_async(self._worker, (tasks.popleft(),)))
+            while pending:
+                rows = pending.popleft().get()
+                if tasks:
+                    pending.append(pool.apply_async(self._worker, (tasks.popleft(),)))
+                for row in self._yield_rows(rows):
+                    yield row
+
+    def _yield_rows(self, rows):
+        for row in rows:
+            self._line_number += 1
+            yield row
+
+    @staticmethod
+    def _worker(task):
+        raise NotImplementedError("Please implement this method")
+
+    def _task(self, start, end):
+        raise NotImplementedError("Please implement this method")
+
+
+class ParallelCsvReader(ParallelReader):
+    """
+    A parallel data reader for csv files. Records must not contain quoted
+    newlines, since ranges are split at line boundaries; a quoted field
+    that is cut off at the end of a range raises ValueError.
+    """
+    def __init__(self, filepath, table_name="tbl", headers=True, delimiter=",", processes=None,
+                 chunk_size=None, encoding='utf-8'):
+        super(ParallelCsvReader, self).__init__(filepath, processes, chunk_size, encoding)
+        self._table_name = table_name
+        self.headers = headers
+        self.delimiter = delimiter
+
+        with open(filepath, 'rb') as infile:
+            first = infile.readline()
+            header = next(csv.reader([first.decode(encoding)], delimiter=delimiter), [])
+            if headers:
+                self._data_start = infile.tell()
+                self._first_line_number = 1
+        if headers:
+            self._set_fields_by_name(header)
+        else:
+            self._ensure_min_defined_fields(len(header))
+
+    def _yield_rows(self, rows):
+        for row in rows:
+            self._line_number += 1
+            self._ensure_min_defined_fields(len(row))
+            yield row
+
+    _worker = staticmethod(_parse_csv_range)
+
+    def _task(self, start, end):
+        return self.filepath, start, end, self.encoding, self.delimiter
+
+
+class ParallelFixedWidthReader(ParallelReader):
+    """
+    A parallel data reader for newline-terminated fixed-width files
+    """
+    def __init__(self, filepath, widths, field_names=(), table_name="tbl", remainder_field_name='remainder',
+                 strip_values=True, processes=None, chunk_size=None, encoding='utf-8'):
+        super(ParallelFixedWidthReader, self).__init__(filepath, processes, chunk_size, encoding)
+        layout = FixedWidthReader(None, widths, field_names, table_name, remainder_field_name, strip_values)
+        self._table_name = table_name
+        self._fields = list(layout.fields)
+        self._widths = tuple(widths)
+        self._remainder_field_name = remainder_field_name
+        self.strip_values = strip_values
+
+    _worker = staticmethod(_parse_fixed_width_range)
+
+    def _task(self, start, end):
+        return (self.filepath, start, end, self.encoding, self._widths, self._remainder_field_name,
+                self.strip_values)
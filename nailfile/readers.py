@@ -1,9 +1,17 @@
+import bz2
+import contextlib
 import csv
+import functools
+import gzip
+import io
+import lzma
+import mmap
+import os
 import re
 import itertools
-
-#TODO: Add multi-record reader
-#TODO: Add data conversion handler
+import operator
+import zipfile
+from datetime import datetime
 
 
 class DataField():
@@ -41,6 +49,9 @@ class DataReader():
         self._table_name = "tbl"
         self._line_number = 0
         self._fields = []
+        self._fields_cache = (None, ())
+        self._schema_state = (None, None)
+        self._schema_version = 0
 
     @property
     def table_name(self):
@@ -64,7 +75,27 @@ class DataReader():
         After each call to read(), this should contain the fields schema
         for the data elements returned
         """
-        return tuple(self._fields)
+        fields = self._fields
+        cache = self._fields_cache
+        if cache[0] is not fields or len(cache[1]) != len(fields):
+            cache = self._fields_cache = (fields, tuple(fields))
+        return cache[1]
+
+    @property
+    def schema_version(self):
+        """
+        A number that changes whenever table_name or fields change, so
+        that work done per schema can be cached until the next change.
+        Readers that override fields should return the same object for
+        as long as the fields stay the same.
+        """
+        fields = self.fields
+        table_name = self.table_name
+        state = self._schema_state
+        if state[0] is not fields or state[1] != table_name:
+            self._schema_state = (fields, table_name)
+            self._schema_version += 1
+        return self._schema_version
 
     def read(self):
         raise NotImplemented("Please implement this method")
@@ -130,9 +161,226 @@ class DataReaderLimiter(DataReaderWrapper):
             yield item
 
 
+class DataReaderSkipper(DataReaderWrapper):
+    """
+    A data reader that skips rows up to and including a line number,
+    for resuming a load where an earlier one left off. line_offset is
+    added to the line numbers reported, for readers that were started
+    partway through a file.
+    """
+    def __init__(self, reader, after_line, line_offset=0):
+        super(DataReaderSkipper, self).__init__(reader)
+        self._after_line = after_line
+        self._line_offset = line_offset
+
+    @property
+    def line_number(self):
+        return self._reader.line_number + self._line_offset
+
+    def read(self):
+        reader = self._reader
+        after_line = self._after_line
+        for row in reader.read():
+            if reader.line_number > after_line:
+                yield row
+
+
+class SourceFileReader(DataReaderWrapper):
+    """
+    A data reader that adds a leading column holding the name of the file
+    each row came from
+    """
+    def __init__(self, reader, source_file, field_name="source_file"):
+        super(SourceFileReader, self).__init__(reader)
+        self.source_file = source_file
+        self._source_field = DataField(field_name, "text")
+
+    @property
+    def fields(self):
+        fields = self._reader.fields
+        cache = self._fields_cache
+        if cache[0] is not fields:
+            cache = self._fields_cache = (fields, (self._source_field,) + tuple(fields))
+        return cache[1]
+
+    def read(self):
+        source = (self.source_file,)
+        for row in self._reader.read():
+            yield source + tuple(row)
+
+
+class TypeInferenceReader(DataReaderWrapper):
+    """
+    A data reader that samples the first rows of another reader to choose
+    an integer, real, date or text column type for each field, and then
+    converts the values to those types as they are read. Values that do not
+    fit the chosen type after the sample are passed through unchanged. Each
+    table is typed on its own, and sampled rows are given back with the
+    table and fields they were read with.
+    """
+    INTEGER = "integer"
+    REAL = "real"
+    DATE = "date"
+    DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y')
+
+    _int_pattern = re.compile(r'^[+-]?(0|[1-9][0-9]*)$')
+    _real_pattern = re.compile(r'^[+-]?((0|[1-9][0-9]*)(\.[0-9]*)?|\.[0-9]+)([eE][+-]?[0-9]+)?$')
+
+    def __init__(self, reader, sample_size=1000, date_formats=None):
+        super(TypeInferenceReader, self).__init__(reader)
+        if sample_size < 1:
+            raise ValueError("Invalid sample size: {0}".format(sample_size))
+        self.sample_size = sample_size
+        self.date_formats = tuple(date_formats) if date_formats is not None else self.DATE_FORMATS
+        self._replaying = False
+        self._replay_fields = ()
+        self._types = {}
+        self._converters = {}
+        self._typed_fields = {}
+        self._last_typed = (None, None, ())
+
+    @property
+    def table_name(self):
+        if self._replaying:
+            return self._table_name
+        return self._reader.table_name
+
+    @property
+    def line_number(self):
+        if self._replaying:
+            return self._line_number
+        return self._reader.line_number
+
+    @property
+    def fields(self):
+        tbl = self.table_name
+        fields = self._replay_fields if self._replaying else self._reader.fields
+        last = self._last_typed
+        if last[0] is fields and last[1] == tbl:
+            return last[2]
+        key = (tbl, tuple(f.name for f in fields))
+        result = self._typed_fields.get(key)
+        if result is None:
+            types = self._types.get(tbl, ())
+            result = []
+            for i, field in enumerate(fields):
+                datatype = types[i] if i < len(types) and types[i] else field.datatype
+                typed = DataField(field.name, datatype)
+                typed.original_name = field.original_name
+                result.append(typed)
+            result = tuple(result)
+            self._typed_fields[key] = result
+        self._last_typed = (fields, tbl, result)
+        return result
+
+    def column_types(self, table_name=None):
+        """
+        The inferred type for each column of a table, or None where the
+        column was left as text
+        """
+        return tuple(self._types.get(table_name or self.table_name, ()))
+
+    def read(self):
+        self._types = {}
+        self._converters = {}
+        self._typed_fields = {}
+        self._last_typed = (None, None, ())
+
+        rows = self._reader.read()
+        sample = []
+        candidates = {}
+        for row in itertools.islice(rows, self.sample_size):
+            tbl = self._reader.table_name
+            sample.append((tbl, self._reader.line_number, self._reader.fields, row))
+            self._observe(candidates.setdefault(tbl, []), row)
+
+        for tbl, columns in candidates.items():
+            chosen = [self._choose_type(c) for c in columns]
+            self._types[tbl] = [t[0] if isinstance(t, tuple) else t for t in chosen]
+            self._converters[tbl] = tuple(self._converter(t) for t in chosen)
+
+        self._replaying = True
+        try:
+            for tbl, line_number, fields, row in sample:
+                self._table_name = tbl
+                self._line_number = line_number
+                self._replay_fields = fields
+                yield self._convert(tbl, row)
+        finally:
+            self._replaying = False
+            self._replay_fields = ()
+
+        for row in rows:
+            yield self._convert(self._reader.table_name, row)
+
+    def _observe(self, columns, row):
+        for i, value in enumerate(row):
+            if i >= len(columns):
+                columns.append(None)
+            if value is None:
+                continue
+            possible = columns[i]
+            if possible is None:
+                possible = [self.INTEGER, self.REAL] + [(self.DATE, f) for f in self.date_formats]
+            columns[i] = [t for t in possible if self._is_type(t, value)]
+
+    def _is_type(self, datatype, value):
+        if datatype == self.INTEGER:
+            if isinstance(value, bool):
+                return False
+            if isinstance(value, int):
+                return True
+            return isinstance(value, str) and self._int_pattern.match(value) is not None and \
+                -2**63 <= int(value) < 2**63
+        elif datatype == self.REAL:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return True
+            return isinstance(value, str) and self._real_pattern.match(value) is not None
+        else:
+            if not isinstance(value, str):
+                return False
+            try:
+                datetime.strptime(value, datatype[1])
+            except ValueError:
+                return False
+            return True
+
+    def _choose_type(self, possible):
+        if possible:
+            return possible[0]
+        return None
+
+    def _converter(self, datatype):
+        if datatype is None:
+            return None
+        elif datatype == self.INTEGER:
+            return int
+        elif datatype == self.REAL:
+            return float
+        else:
+            date_format = datatype[1]
+            return lambda v: datetime.strptime(v, date_format).strftime('%Y-%m-%d')
+
+    def _convert(self, table_name, row):
+        converters = self._converters.get(table_name, ())
+        result = list(row)
+        for i, fn in enumerate(converters[0:len(result)]):
+            value = result[i]
+            if fn is not None and value is not None:
+                try:
+                    result[i] = fn(value)
+                except (TypeError, ValueError):
+                    pass
+        return tuple(result)
+
+
 class CollectionReader(DataReader):
     """
-    A data reader for collections
+    A data reader for collections. The first row is peeked from the
+    iterable returned by fn_get_data to learn the header, and the first
+    call to read() continues from that same iterable, so one-shot sources
+    are only ever iterated once. Later calls to read() call fn_get_data
+    again.
     """
     def __init__(self, fn_get_data, table_name="tbl", headers=True):
         super(CollectionReader, self).__init__()
@@ -141,7 +389,9 @@ class CollectionReader(DataReader):
         self.headers = headers
         self.fn_get_data = fn_get_data
 
-        header = self._read_first()
+        self._pending = iter(fn_get_data())
+        self._first = next(self._pending, None)
+        header = self._first if self._first is not None else ()
         if headers:
             self._set_fields_by_name(header)
         else:
@@ -149,37 +399,140 @@ class CollectionReader(DataReader):
 
     def read(self):
         self._line_number = 0
-        for row in self.fn_get_data():
+        for row in self._get_rows():
             self._line_number += 1
             if self._line_number > 1 or not self.headers:
-                self._ensure_min_defined_fields(len(row))
+                if len(row) > len(self._fields):
+                    self._ensure_min_defined_fields(len(row))
                 result = tuple(self._format_value(v) for v in row)
                 yield result
 
-    def _read_first(self):
-        for line in self.fn_get_data():
-            return line
+    def _get_rows(self):
+        if self._pending is None:
+            return self.fn_get_data()
+        rows, first = self._pending, self._first
+        self._pending = self._first = None
+        if first is None:
+            return rows
+        return itertools.chain((first,), rows)
+
+
+# patterns for the leading bytes of each supported compressed format
+COMPRESSION_MAGIC = (
+    (re.compile(b'\x1f\x8b'), 'gzip'),
+    # "BZh", the block size, then the magic of the first block or, for an
+    # empty stream, of the end of stream marker
+    (re.compile(b'BZh[1-9](1AY&SY|\x17rE8P\x90)'), 'bz2'),
+    (re.compile(b'\xfd7zXZ\x00'), 'xz'),
+    (re.compile(b'PK(\x03\x04|\x05\x06)'), 'zip'),
+)
+COMPRESSION_MAGIC_LENGTH = 10
+COMPRESSION_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zip')
+INPUT_BUFFER_SIZE = 1024 * 1024
+
+
+def detect_compression(filepath):
+    """
+    Returns 'gzip', 'bz2', 'xz' or 'zip' based on the first bytes of a
+    file, or None for anything else
+    """
+    with open(filepath, 'rb') as infile:
+        return _compression_of(infile.read(COMPRESSION_MAGIC_LENGTH))
+
+
+def _compression_of(head):
+    for magic, compression in COMPRESSION_MAGIC:
+        if magic.match(head):
+            return compression
+    return None
+
+
+@contextlib.contextmanager
+def open_input(filepath, encoding=None, newline=None, buffer_size=None):
+    """
+    Opens a file for reading as text, decompressing gzip, bz2, xz and
+    single-member zip files on the fly. The compression is detected from
+    the file's first bytes, not its name. Decompressed data is read
+    buffer_size bytes at a time.
+    """
+    buffer_size = buffer_size or INPUT_BUFFER_SIZE
+    with contextlib.ExitStack() as stack:
+        raw = stack.enter_context(open(filepath, 'rb', buffering=buffer_size))
+        compression = _compression_of(raw.peek(COMPRESSION_MAGIC_LENGTH)[0:COMPRESSION_MAGIC_LENGTH])
+        if compression is None:
+            yield stack.enter_context(io.TextIOWrapper(raw, encoding=encoding, newline=newline))
+            return
+
+        if compression == 'zip':
+            archive = stack.enter_context(zipfile.ZipFile(raw))
+            members = [m for m in archive.infolist() if not m.is_dir()]
+            if len(members) != 1:
+                raise ValueError("{0} has {1} members; use ZipReader to read each of them".format(
+                    filepath, len(members)))
+            stream = stack.enter_context(archive.open(members[0]))
+        elif compression == 'gzip':
+            stream = stack.enter_context(gzip.GzipFile(fileobj=raw))
+        elif compression == 'bz2':
+            stream = stack.enter_context(bz2.BZ2File(raw))
+        else:
+            stream = stack.enter_context(lzma.LZMAFile(raw))
+        buffered = io.BufferedReader(stream, buffer_size)
+        yield stack.enter_context(io.TextIOWrapper(buffered, encoding=encoding, newline=newline))
+
+
+def file_lines(filepath, encoding=None, buffer_size=None):
+    """
+    Returns a function suitable as the fn_get_data of FixedWidthReader that
+    yields the lines of a plain or compressed file without line endings.
+    It is a functools.partial, so DatasetCache can describe it.
+    """
+    return functools.partial(_file_lines, filepath, encoding, buffer_size)
+
+
+def _file_lines(filepath, encoding, buffer_size):
+    with open_input(filepath, encoding=encoding, buffer_size=buffer_size) as infile:
+        for line in infile:
+            yield line.rstrip('\r\n')
+
+
+def _reject_compressed(filepath, reader_name, head=None):
+    if head is None:
+        compression = detect_compression(filepath)
+    else:
+        compression = _compression_of(head)
+    if compression is not None:
+        raise ValueError("{0} cannot read {1} compressed input: {2}".format(reader_name, compression, filepath))
 
 
 class CsvReader(CollectionReader):
     """
-    A data reader for csv files
+    A data reader for csv files. filepath may be a path or an open text
+    file-like object such as sys.stdin; file-like objects are read from
+    their current position and are not closed by the reader. Compressed
+    files are decompressed as they are read (see open_input).
     """
-    def __init__(self, filepath, table_name="tbl", headers=True, delimiter=","):
+    def __init__(self, filepath, table_name="tbl", headers=True, delimiter=",", encoding=None):
         self.filepath = filepath
         self.delimiter = delimiter
+        self.encoding = encoding
         super(CsvReader, self).__init__(self._read_file, table_name, headers)
 
     def _read_file(self):
-        with open(self.filepath) as infile:
-            r = csv.reader(infile, delimiter=self.delimiter)
-            for row in r:
+        if hasattr(self.filepath, 'read'):
+            for row in csv.reader(self.filepath, delimiter=self.delimiter):
                 yield row
+        else:
+            with open_input(self.filepath, encoding=self.encoding, newline='') as infile:
+                r = csv.reader(infile, delimiter=self.delimiter)
+                for row in r:
+                    yield row
 
 
 class FixedWidthReader(DataReader):
     """
-    A data reader for fixed-width data
+    A data reader for fixed-width data. Field offsets are compiled once into
+    a single itemgetter of slices, so each line is split in one call. Use
+    file_lines(filepath) as fn_get_data to read plain or compressed files.
     """
     def __init__(self, fn_get_data, widths, field_names=(), table_name="tbl",
                  remainder_field_name='remainder', strip_values=True):
@@ -210,17 +563,39 @@ class FixedWidthReader(DataReader):
         if self._remainder_field_name:
             self._fields.append(DataField(self._remainder_field_name, "text"))
 
+        self._split = self._compile_slices(self._widths, bool(self._remainder_field_name))
+
     def read(self):
         self._line_number = 0
+        split = self._split
+        if self.strip_values:
+            to_row = lambda line: tuple([v.strip() or None for v in split(line)])
+        else:
+            to_row = lambda line: tuple([v or None for v in split(line)])
+
         for line in self._fn_get_data():
-            result = []
-            pos = 0
-            for w in self._widths:
-                result.append(self._format_value(line[pos:pos+w]))
-                pos += w
-            if self._remainder_field_name:
-                result.append(self._format_value(line[pos:]))
-            yield tuple(result)
+            self._line_number += 1
+            yield to_row(line)
+
+    @staticmethod
+    def _compile_slices(widths, include_remainder, keep=None):
+        """
+        Returns a function that splits a record into a tuple of its fields,
+        optionally limited to the field positions in keep
+        """
+        slices = []
+        pos = 0
+        for w in widths:
+            slices.append(slice(pos, pos + w))
+            pos += w
+        if include_remainder:
+            slices.append(slice(pos, None))
+        if keep is not None:
+            slices = [slices[i] for i in keep]
+        if len(slices) == 1:
+            only = slices[0]
+            return lambda line: (line[only],)
+        return operator.itemgetter(*slices)
 
     def _format_value(self, value):
         if value is not None:
@@ -229,3 +604,411 @@ class FixedWidthReader(DataReader):
             if len(value) == 0:
                 return None
         return value
+
+
+class RecordLayout():
+    """
+    The layout of one record type in a multi-record fixed-width file
+    """
+    def __init__(self, widths, field_names=(), table_name=None):
+        self.widths = tuple(widths)
+        self.field_names = tuple(field_names)
+        self.table_name = table_name
+
+
+class MultiRecordFixedWidthReader(DataReader):
+    """
+    A data reader for fixed-width files that mix several record layouts,
+    such as header, detail and trailer records. The record type code is
+    read from a fixed position in each line and looked up in a dispatch
+    table compiled from layouts, a mapping of record type code to a
+    RecordLayout (or a (widths, field_names, table_name) tuple). After each
+    row, table_name and fields describe that row's record type. Record
+    types that share a table must agree on its field names, though one
+    may add fields at the end. Lines with an unknown record type raise a
+    ValueError, or are skipped when skip_unknown is set.
+    """
+    def __init__(self, fn_get_data, layouts, record_type_start, record_type_width,
+                 remainder_field_name='remainder', strip_values=True, skip_unknown=False):
+        super(MultiRecordFixedWidthReader, self).__init__()
+        if len(layouts) == 0:
+            raise ValueError("No record layouts provided")
+        if record_type_start < 0 or record_type_width < 1:
+            raise ValueError("Invalid record type position")
+
+        self._fn_get_data = fn_get_data
+        self._record_type = slice(record_type_start, record_type_start + record_type_width)
+        self.strip_values = strip_values
+        self.skip_unknown = skip_unknown
+
+        self._remainder_field_name = remainder_field_name
+        self._layouts = []
+        self._dispatch = {}
+        table_fields = {}
+        for code, layout in layouts.items():
+            if not isinstance(layout, RecordLayout):
+                layout = RecordLayout(*layout)
+            if len(code) != record_type_width:
+                raise ValueError("Record type {0!r} is not {1} characters wide".format(code, record_type_width))
+            table_name = layout.table_name or "tbl_{0}".format(code)
+            self._layouts.append((code, layout.widths, layout.field_names, table_name))
+            plan = FixedWidthReader(None, layout.widths, layout.field_names, table_name, remainder_field_name,
+                                    strip_values)
+            _check_shared_fields(table_fields, table_name, plan._fields, "record type {0!r}".format(code))
+            self._dispatch[code] = (table_name, tuple(plan._fields), plan._split)
+        self._layouts.sort()
+
+        first = next(iter(self._dispatch.values()))
+        self._table_name = first[0]
+        self._fields = first[1]
+
+    def read(self):
+        self._line_number = 0
+        dispatch = self._dispatch
+        record_type = self._record_type
+        strip_values = self.strip_values
+        for line in self._fn_get_data():
+            self._line_number += 1
+            plan = dispatch.get(line[record_type])
+            if plan is None:
+                if self.skip_unknown:
+                    continue
+                raise ValueError("Unknown record type {0!r} on line {1}".format(line[record_type],
+                                                                                 self._line_number))
+            self._table_name, self._fields, split = plan
+            if strip_values:
+                yield tuple([v.strip() or None for v in split(line)])
+            else:
+                yield tuple([v or None for v in split(line)])
+
+
+class MmapFixedWidthReader(FixedWidthReader):
+    """
+    A data reader for large fixed-width files that memory-maps the file.
+    Widths are in bytes. Records are found in the mapped buffer either by
+    line_terminator or, when record_length is given, by fixed length with
+    no terminator at all. When most fields are kept, the map is decoded a
+    block at a time and records are sliced from the text; otherwise only
+    the fields named in keep_fields are decoded, from memoryview slices.
+    Compressed files cannot be mapped; read them with FixedWidthReader and
+    file_lines instead.
+    """
+    def __init__(self, filepath, widths, field_names=(), table_name="tbl",
+                 remainder_field_name='remainder', strip_values=True, record_length=None,
+                 line_terminator=b'\n', encoding='utf-8', keep_fields=None):
+        super(MmapFixedWidthReader, self).__init__(None, widths, field_names, table_name,
+                                                   remainder_field_name, strip_values)
+        if record_length is not None and record_length < 1:
+            raise ValueError("Invalid record length: {0}".format(record_length))
+        if record_length is None and not line_terminator:
+            raise ValueError("Either a record length or a line terminator is required")
+        if isinstance(line_terminator, str):
+            line_terminator = line_terminator.encode(encoding)
+
+        self.filepath = filepath
+        self.record_length = record_length
+        self.line_terminator = line_terminator
+        self.encoding = encoding
+
+        keep = None
+        if keep_fields is not None:
+            keep_fields = set(keep_fields)
+            keep = [i for i, f in enumerate(self._fields) if f.name in keep_fields or f.original_name in keep_fields]
+            if len(keep) != len(keep_fields):
+                known = set(f.name for f in self._fields) | set(f.original_name for f in self._fields)
+                raise ValueError("Unknown fields to keep: {0}".format(", ".join(sorted(keep_fields - known))))
+            self._fields = [self._fields[i] for i in keep]
+        self._split = self._compile_slices(self._widths, bool(self._remainder_field_name), keep)
+        # with most fields kept, decoding whole blocks of records and slicing
+        # the text is cheaper than decoding each field
+        self._decode_blocks = keep is None or len(keep) * 2 >= len(widths)
+
+    BLOCK_SIZE = 1024 * 1024
+
+    def read(self):
+        self._line_number = 0
+        split = self._split
+        if self.strip_values:
+            to_row = lambda values: tuple([v.strip() or None for v in values])
+        else:
+            to_row = lambda values: tuple([v or None for v in values])
+
+        with open(self.filepath, 'rb') as infile:
+            if os.fstat(infile.fileno()).st_size == 0:
+                return
+            mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                _reject_compressed(self.filepath, type(self).__name__, mm[0:COMPRESSION_MAGIC_LENGTH])
+                with memoryview(mm) as view:
+                    if self._decode_blocks:
+                        blocks = self._decoded_blocks(mm, view)
+                    else:
+                        blocks = (([values], False) for values in self._split_records(mm, view, 0, len(mm)))
+                    try:
+                        for records, needs_split in blocks:
+                            if needs_split:
+                                for record in records:
+                                    self._line_number += 1
+                                    yield to_row(split(record))
+                            else:
+                                for values in records:
+                                    self._line_number += 1
+                                    yield to_row(values)
+                    finally:
+                        # the record views must be gone before the map is closed
+                        blocks.close()
+            finally:
+                mm.close()
+
+    def _decoded_blocks(self, mm, view):
+        """
+        Decodes the map a block at a time and yields (records, True) with
+        the decoded records of each block, still to be split into fields.
+        Widths are in bytes, so a block holding multi-byte characters is
+        split before decoding instead and yielded as (fields, False). Rows
+        are built by the caller one at a time, since building a whole
+        block of them at once keeps the garbage collector busy.
+        """
+        encoding = self.encoding
+        size = len(mm)
+        if self.record_length:
+            step = self.record_length
+            block_size = max(self.BLOCK_SIZE // step, 1) * step
+        else:
+            term = self.line_terminator
+            term_text = term.decode(encoding)
+            strip_cr = term == b'\n'
+
+        start = 0
+        while start < size:
+            if self.record_length:
+                end = min(start + block_size, size)
+            else:
+                end = mm.find(term, start + self.BLOCK_SIZE)
+                end = size if end < 0 else end + len(term)
+            text = str(view[start:end], encoding)
+            if len(text) != end - start:
+                yield self._split_records(mm, view, start, end), False
+            elif self.record_length:
+                yield [text[pos:pos + step] for pos in range(0, len(text), step)], True
+            else:
+                if strip_cr:
+                    text = text.replace('\r\n', '\n')
+                lines = text.split(term_text)
+                if not lines[-1]:
+                    lines.pop()
+                yield lines, True
+            start = end
+
+    def _split_records(self, mm, view, start, end):
+        """
+        Yields the decoded fields of each record between start and end,
+        slicing memoryviews of the map so records are not copied
+        """
+        split = self._split
+        encoding = self.encoding
+        pos = start
+        if self.record_length:
+            step = self.record_length
+            while pos < end:
+                yield [str(v, encoding) for v in split(view[pos:min(pos + step, end)])]
+                pos += step
+        else:
+            term = self.line_terminator
+            term_len = len(term)
+            strip_cr = term == b'\n'
+            find = mm.find
+            while pos < end:
+                record_end = find(term, pos, end)
+                if record_end < 0:
+                    record_end = end
+                next_pos = record_end + term_len
+                if strip_cr and record_end > pos and mm[record_end - 1] == 13:
+                    record_end -= 1
+                yield [str(v, encoding) for v in split(view[pos:record_end])]
+                pos = next_pos
+
+
+class X12Reader(DataReader):
+    """
+    A data reader for X12 EDI interchanges such as 834 and 278 files. The
+    element, sub-element and segment delimiters are taken from the ISA
+    header. The input is tokenized block by block, so memory use does not
+    grow with the size of the interchange. Each segment is returned as a
+    row in a table named for its segment id (with an optional prefix), and
+    its elements are named by position, e.g. NM101, NM102. Composite
+    elements are left intact; split them with sub_element_separator.
+    filepath may be a path, optionally compressed, or an open text
+    file-like object.
+    """
+    BLOCK_SIZE = 64 * 1024
+    ISA_LENGTH = 106
+
+    def __init__(self, filepath, table_prefix="", encoding='latin-1', block_size=None):
+        super(X12Reader, self).__init__()
+        self.filepath = filepath
+        self.table_prefix = table_prefix
+        self.encoding = encoding
+        self.block_size = block_size or self.BLOCK_SIZE
+        self.element_separator = None
+        self.sub_element_separator = None
+        self.segment_terminator = None
+        self._segment_fields = {}
+
+    def read(self):
+        self._line_number = 0
+        for segment in self._read_segments():
+            self._line_number += 1
+            elements = segment.split(self.element_separator)
+            segment_id = elements[0].strip()
+            fields = self._segment_fields.get(segment_id)
+            if fields is None:
+                fields = self._segment_fields[segment_id] = []
+            for i in range(len(fields), len(elements) - 1):
+                fields.append(DataField("{0}{1:02d}".format(segment_id, i + 1)))
+            self._table_name = self.table_prefix + segment_id
+            self._fields = fields
+            yield tuple([self._format_value(v) for v in elements[1:]])
+
+    def _read_segments(self):
+        if hasattr(self.filepath, 'read'):
+            for segment in self._tokenize(self.filepath):
+                yield segment
+        else:
+            with open_input(self.filepath, encoding=self.encoding, newline='') as infile:
+                for segment in self._tokenize(infile):
+                    yield segment
+
+    def _tokenize(self, infile):
+        block_size = self.block_size
+        buffer = ""
+        while True:
+            block = infile.read(block_size)
+            buffer += block
+            buffer = buffer.lstrip('\ufeff \t\r\n')
+            if len(buffer) >= self.ISA_LENGTH or not block:
+                break
+        if not buffer:
+            return
+        if not buffer.startswith("ISA") or len(buffer) < self.ISA_LENGTH:
+            raise ValueError("X12 data must begin with a complete ISA segment")
+        self.element_separator = buffer[3]
+        self.sub_element_separator = buffer[104]
+        self.segment_terminator = terminator = buffer[105]
+
+        while True:
+            segments = buffer.split(terminator)
+            buffer = segments.pop()
+            for segment in segments:
+                segment = segment.strip('\r\n')
+                if segment:
+                    yield segment
+            block = infile.read(block_size)
+            if not block:
+                break
+            buffer += block
+        buffer = buffer.strip('\r\n')
+        if buffer:
+            yield buffer
+
+
+class ZipReader(DataReader):
+    """
+    A data reader for every file in a zip archive. reader_factory is
+    called with an open text stream for each member and the table name
+    for it, and returns the reader for that member, for example
+    lambda stream, table_name: CsvReader(stream, table_name). Each member
+    gets a table named after it unless table_name is given, in which case
+    every member shares that table. A source_field_name column records the
+    member each row came from; pass None to leave it out. Members that
+    share a table must have the same fields, though later members may add
+    fields at the end.
+    """
+    def __init__(self, filepath, reader_factory, table_name=None, source_field_name="source_file",
+                 encoding=None, buffer_size=None):
+        super(ZipReader, self).__init__()
+        self.filepath = filepath
+        self.reader_factory = reader_factory
+        self.shared_table_name = table_name
+        self.source_field_name = source_field_name
+        self.encoding = encoding
+        self.buffer_size = buffer_size or INPUT_BUFFER_SIZE
+        self._reader = None
+        if table_name is not None:
+            self._table_name = table_name
+
+    @property
+    def table_name(self):
+        if self._reader is None:
+            return self._table_name
+        return self._reader.table_name
+
+    @property
+    def line_number(self):
+        if self._reader is None:
+            return self._line_number
+        return self._reader.line_number
+
+    @property
+    def fields(self):
+        if self._reader is None:
+            return super(ZipReader, self).fields
+        return self._reader.fields
+
+    def member_table_name(self, member_name):
+        """
+        The table name used for a member when table_name is not given
+        """
+        return table_name_for_file(member_name)
+
+    def read(self):
+        table_fields = {}
+        with zipfile.ZipFile(self.filepath) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                table_name = self.shared_table_name or self.member_table_name(info.filename)
+                buffered = io.BufferedReader(archive.open(info), self.buffer_size)
+                with io.TextIOWrapper(buffered, encoding=self.encoding, newline='') as stream:
+                    reader = self.reader_factory(stream, table_name)
+                    if self.source_field_name:
+                        reader = SourceFileReader(reader, info.filename, self.source_field_name)
+                    self._reader = reader
+                    checked = None
+                    try:
+                        for row in reader.read():
+                            if reader.fields is not checked:
+                                checked = reader.fields
+                                self._check_fields(table_fields, info.filename)
+                            yield row
+                    finally:
+                        self._reader = None
+
+    def _check_fields(self, table_fields, member_name):
+        _check_shared_fields(table_fields, self._reader.table_name, self._reader.fields, member_name)
+
+
+def table_name_for_file(filepath):
+    """
+    A table name made from a file's name without its directory, extension
+    or compression extension
+    """
+    base, ext = os.path.splitext(os.path.basename(filepath))
+    if ext.lower() in COMPRESSION_EXTENSIONS:
+        base = os.path.splitext(base)[0]
+    return DataField(base).name or "tbl"
+
+
+def _check_shared_fields(table_fields, table_name, fields, source):
+    """
+    Checks that fields from source agree with the fields already seen for
+    table_name in table_fields, which maps table names to field names.
+    Later sources may add fields at the end.
+    """
+    names = tuple(f.name for f in fields)
+    known = table_fields.get(table_name, ())
+    shorter = min(len(names), len(known))
+    if names[0:shorter] != known[0:shorter]:
+        raise ValueError("The fields of {0} do not match earlier sources for table {1}".format(source, table_name))
+    if len(names) > len(known):
+        table_fields[table_name] = names
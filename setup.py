@@ -6,7 +6,7 @@ setup(
     author='Matt McElheny',
     author_email='mattmc3@gmail.com',
     packages=['nailfile', 'nailfile.test'],
-    scripts=[],
+    scripts=['bin/nailfile'],
     url='http://pypi.python.org/pypi/NailFile/',
     license='LICENSE.txt',
     description='.',
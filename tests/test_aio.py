@@ -0,0 +1,64 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from nailfile import aio
+
+
+class AsyncDataStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmpdir, 'test.db')
+        conn = sqlite3.connect(self.database)
+        conn.execute('create table nums (n integer)')
+        conn.executemany('insert into nums values (?)', [(i,) for i in range(2500)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_queries(self):
+        async def run():
+            async with aio.AsyncDataStore(self.database, workers=2) as store:
+                self.assertEqual(await store.scalar('select count(*) from nums'), 2500)
+                rows = await store.fetchall('select n from nums where n < ? order by n', 3)
+                self.assertEqual([r.n for r in rows], [0, 1, 2])
+                total = 0
+                async for row in store.iterquery('select n from nums', batch_size=700):
+                    total += row.n
+                self.assertEqual(total, sum(range(2500)))
+        asyncio.run(run())
+
+    def test_cancelled_query_is_interrupted(self):
+        slow = 'with recursive c(x) as (select 1 union all select x + 1 from c) select count(*) from c'
+
+        async def run():
+            async with aio.AsyncDataStore(self.database) as store:
+                task = asyncio.ensure_future(store.scalar(slow))
+                await asyncio.sleep(0.1)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                self.assertEqual(await asyncio.wait_for(store.scalar('select count(*) from nums'), 5), 2500)
+        asyncio.run(run())
+
+    def test_execute_and_commit_share_a_connection(self):
+        slow = 'with recursive c(x) as (select 1 union all select x + 1 from c where x < 3000000) ' \
+               'select count(*) from c'
+
+        async def run():
+            async with aio.AsyncDataStore(self.database, workers=2) as store:
+                busy = asyncio.ensure_future(store.scalar(slow))
+                await asyncio.sleep(0.05)
+                await store.execute('insert into nums values (?)', -1)
+                await busy
+                await store.commit()
+        asyncio.run(run())
+        conn = sqlite3.connect(self.database)
+        try:
+            self.assertEqual(conn.execute('select count(*) from nums where n = -1').fetchone()[0], 1)
+        finally:
+            conn.close()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+from nailfile import cache
+from nailfile import readers
+
+
+class DatasetCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache#1')
+        self.path = os.path.join(self.tmpdir, 'people.txt')
+        with open(self.path, 'w') as outfile:
+            outfile.write("num\tname\n1\tCliff\n2\tClair\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_second_load_is_a_cache_hit(self):
+        dc = cache.DatasetCache(self.cache_dir)
+        ds = dc.load(readers.CsvReader(self.path, delimiter='\t'), self.path)
+        self.assertEqual(ds.scalar('select count(*) from tbl'), 2)
+        self.assertEqual((dc.hits, dc.misses), (0, 1))
+
+        ds = dc.load(readers.CsvReader(self.path, delimiter='\t'), self.path)
+        self.assertEqual((dc.hits, dc.misses), (1, 1))
+        self.assertEqual(ds.scalar('select name from tbl where num = ?', '2'), 'Clair')
+
+        ds = dc.load(readers.CsvReader(self.path, delimiter='\t'), self.path, in_memory=True)
+        self.assertEqual(ds.execute('delete from tbl'), 2)
+
+    def test_reader_settings_and_file_changes_miss(self):
+        dc = cache.DatasetCache(self.cache_dir)
+        dc.load(readers.CsvReader(self.path, delimiter='\t'), self.path)
+        dc.load(readers.CsvReader(self.path, delimiter='\t', table_name='people'), self.path)
+        dc.load(readers.CsvReader(self.path, delimiter='\t'), self.path, record_number_field=None)
+        with open(self.path, 'a') as outfile:
+            outfile.write("3\tTheo\n")
+        ds = dc.load(readers.CsvReader(self.path, delimiter='\t'), self.path)
+        self.assertEqual(ds.scalar('select count(*) from tbl'), 3)
+        self.assertEqual((dc.hits, dc.misses), (0, 4))
+
+    def test_readers_that_cannot_be_described_need_a_key(self):
+        dc = cache.DatasetCache(self.cache_dir)
+        fn_get_data = readers.file_lines(self.path)
+        keys = set()
+        for layouts, start in (({'n': ((1, 3), ('a', 'b'))}, 0), ({'u': ((1, 3), ('a', 'b'))}, 0),
+                               ({'n': ((1, 3), ('a', 'b'))}, 1), ({'n': ((2, 2), ('a', 'b'))}, 0)):
+            reader = readers.MultiRecordFixedWidthReader(fn_get_data, layouts, start, 1)
+            keys.add(dc.cache_key(reader, self.path))
+        self.assertEqual(len(keys), 4)
+
+        for delimiter in ('|', ','):
+            reader = readers.ZipReader(self.path, lambda s, t: readers.CsvReader(s, t, delimiter=delimiter))
+            self.assertRaises(ValueError, dc.cache_key, reader, self.path)
+        reader = readers.FixedWidthReader(lambda: fn_get_data(), (1, 1))
+        self.assertRaises(ValueError, dc.load, reader, self.path)
+        ds = dc.load(reader, self.path, key='people.txt widths 1,1')
+        self.assertEqual(ds.scalar('select count(*) from tbl'), 3)
+        ds = dc.load(readers.FixedWidthReader(lambda: fn_get_data(), (1, 1)), self.path, key='people.txt widths 1,1')
+        self.assertEqual((dc.hits, dc.misses), (1, 1))
+        self.assertNotEqual(dc.cache_key(readers.FixedWidthReader(fn_get_data, (1, 1)), self.path),
+                            dc.cache_key(readers.FixedWidthReader(readers.file_lines(self.path, 'latin-1'), (1, 1)),
+                                         self.path))
+
+    def test_evicts_least_recently_used(self):
+        dc = cache.DatasetCache(self.cache_dir)
+        dc.load(readers.CsvReader(self.path, delimiter='\t', table_name='a'), self.path)
+        dc.load(readers.CsvReader(self.path, delimiter='\t', table_name='b'), self.path)
+        entries = dc.entries()
+        self.assertEqual(len(entries), 2)
+        os.utime(entries[1][2], (0, 0))
+        dc.max_bytes = entries[0][1]
+        dc.evict()
+        self.assertEqual([e[2] for e in dc.entries()], [entries[0][2]])
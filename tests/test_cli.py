@@ -0,0 +1,102 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from nailfile import cli
+
+
+class CliTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.people = os.path.join(self.tmpdir, 'people.csv.gz')
+        with gzip.open(self.people, 'wt') as outfile:
+            outfile.write("num,name,gender\n1,Cliff,M\n2,Clair,F\n3,Theo,M\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_cli(self, *argv):
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            status = cli.main(list(argv))
+        return status, out.getvalue(), err.getvalue()
+
+    def test_query_formats(self):
+        status, out, err = self.run_cli(self.people, '-q', 'select gender, count(*) n from people group by gender')
+        self.assertEqual((status, out), (0, "gender,n\nF,1\nM,2\n"))
+
+        status, out, err = self.run_cli(self.people, '-q', 'select name from people', '-f', 'tsv', '--omit-header')
+        self.assertEqual(out, "Cliff\nClair\nTheo\n")
+
+        status, out, err = self.run_cli(self.people, '-f', 'jsonl', '--limit', '2')
+        rows = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual([r['name'] for r in rows], ['Cliff', 'Clair'])
+
+    def test_db_is_kept_and_reused(self):
+        db = os.path.join(self.tmpdir, 'people.db')
+        status, out, err = self.run_cli(self.people, '--db', db, '--table', 'family', '--source-column', 'src')
+        self.assertEqual(status, 0)
+        status, out, err = self.run_cli('--db', db, '-q', 'select count(distinct src) from family', '--omit-header')
+        self.assertEqual((status, out), (0, "1\n"))
+
+    def test_loading_into_db_again_skips_loaded_files(self):
+        db = os.path.join(self.tmpdir, 'people.db')
+        plain = os.path.join(self.tmpdir, 'more.csv')
+        with open(plain, 'w') as outfile:
+            outfile.write("num,name,gender\n4,Vanessa,F\n")
+        for _ in range(2):
+            status, out, err = self.run_cli(self.people, plain, '--db', db, '--table', 'family',
+                                            '-q', 'select count(*) from family', '--omit-header')
+            self.assertEqual((status, out, err), (0, "4\n", ""))
+
+        with open(plain, 'a') as outfile:
+            outfile.write("5,Rudy,F\n")
+        status, out, err = self.run_cli(self.people, plain, '--db', db, '--table', 'family', '--omit-header')
+        self.assertEqual(len(out.splitlines()), 5)
+
+    def test_db_loads_files_without_trailing_newline_whole(self):
+        path = os.path.join(self.tmpdir, 'g.csv')
+        with open(path, 'w') as outfile:
+            outfile.write("a,b\n1,2\n3,4")
+        query = ('-q', 'select count(*) from g', '--omit-header')
+        self.assertEqual(self.run_cli(path, *query)[1], "2\n")
+        db = os.path.join(self.tmpdir, 'g.db')
+        for _ in range(2):
+            self.assertEqual(self.run_cli(path, '--db', db, *query), (0, "2\n", ""))
+
+    def test_db_loads_x12_without_newlines(self):
+        path = os.path.join(self.tmpdir, 'e.834')
+        with open(path, 'w') as outfile:
+            outfile.write("ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECEIVER       "
+                          "*140301*1200*^*00501*000000001*0*P*:~NM1*IL*1*HUXTABLE*CLIFF~NM1*IL*1*HUXTABLE*CLAIR~")
+        db = os.path.join(self.tmpdir, 'e.db')
+        for _ in range(2):
+            status, out, err = self.run_cli(path, '--db', db, '-q', 'select count(*) from e_NM1', '--omit-header')
+            self.assertEqual((status, out, err), (0, "2\n", ""))
+
+    def test_db_load_cut_short_by_limit_is_loaded_again(self):
+        path = os.path.join(self.tmpdir, 't.csv')
+        with open(path, 'w') as outfile:
+            outfile.write("n\n1\n2\n3\n4\n")
+        db = os.path.join(self.tmpdir, 't.db')
+        query = ('-q', 'select count(*), max(line_num) from t', '--omit-header')
+        self.assertEqual(self.run_cli(path, '--db', db, '--limit', '2', *query)[1], "2,3\n")
+        self.assertEqual(self.run_cli(path, '--db', db, *query)[1], "4,5\n")
+        with open(path, 'a') as outfile:
+            outfile.write("5\n")
+        self.assertEqual(self.run_cli(path, '--db', db, *query)[1], "5,6\n")
+
+    def test_errors_are_reported(self):
+        other = os.path.join(self.tmpdir, 'other.csv')
+        with open(other, 'w') as outfile:
+            outfile.write("a\n1\n")
+        status, out, err = self.run_cli(self.people, other)
+        self.assertEqual(status, 1)
+        self.assertIn("other, people", err)
+        with self.assertRaises(SystemExit):
+            self.run_cli()
@@ -1,8 +1,18 @@
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
 import unittest
 from nailfile import readers
 from nailfile import nailfile
 
-#TODO: Test dump()
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 class NailFileTests(unittest.TestCase):
@@ -124,3 +134,531 @@ class NailFileTests(unittest.TestCase):
         self.assertEqual(len(guys), 2)
         self.assertTrue(guys[0].name.startswith('Theo'))
         self.assertTrue(guys[1].name.startswith('Cliff'))
+
+    def test_batched_load_keeps_line_numbers(self):
+        huxtables = self.get_list_data()
+        huxtables.append([8, 'Olivia', 'F', None, 'step granddaughter', 'Jump the shark!'],)
+        huxtables.append([9, 'Pam Tucker', 'F', None, 'cousin'],)
+        fn_get_list_data = lambda: (c for c in huxtables)
+        reader = readers.CollectionReader(fn_get_list_data)
+        loader = nailfile.DataLoader(batch_size=3)
+        ds = loader.load(reader)
+        self.assertEqual(ds.scalar('select count(*) from tbl'), 9)
+        rows = ds.fetchall('select line_num, person_num, unnamed_field006 from tbl order by row_id')
+        self.assertEqual([r.line_num for r in rows], list(range(2, 11)))
+        self.assertEqual(rows[7].unnamed_field006, 'Jump the shark!')
+        self.assertIsNone(rows[8].unnamed_field006)
+
+    def test_fixed_width_load_records_line_numbers(self):
+        ds = self.load_fixed_width_data()
+        line_nums = [r.line_num for r in ds.fetchall('select line_num from tbl order by row_id')]
+        self.assertEqual(line_nums, list(range(1, 8)))
+
+    def test_ingest_profile_restores_pragmas(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            conn = sqlite3.connect(os.path.join(tmpdir, 'test.db'))
+            conn.row_factory = nailfile.DataStore.datarow_factory
+            synchronous = conn.execute('PRAGMA synchronous').fetchone()['synchronous']
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()['journal_mode']
+            fn_get_list_data = lambda: (c for c in self.get_list_data())
+            reader = readers.CollectionReader(fn_get_list_data)
+            loader = nailfile.DataLoader(profile='bulk-file')
+            ds = loader.load(reader, connection=conn)
+            self.assertEqual(ds.scalar('select count(*) from tbl'), 7)
+            self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()['synchronous'], synchronous)
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()['journal_mode'], journal_mode)
+            self.assertEqual(conn.execute('PRAGMA locking_mode').fetchone()['locking_mode'], 'normal')
+            self.assertFalse(conn.in_transaction)
+            conn.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_unknown_ingest_profile(self):
+        self.assertRaises(ValueError, nailfile.DataLoader, profile='warp-speed')
+
+    def test_type_inference_creates_typed_columns(self):
+        data = [
+            ['id', 'amount', 'zip', 'service_date', 'note'],
+            ['1', '12.50', '01234', '2014-03-01', 'a'],
+            ['2', '7', '55401', '2014-03-02', None],
+            ['3', '100.25', '60601', '2014-03-03', '4'],
+            ['4', 'n/a', '10001', '2014-03-04', 'd'],
+        ]
+        fn_get_list_data = lambda: (c for c in data)
+        reader = readers.TypeInferenceReader(readers.CollectionReader(fn_get_list_data), sample_size=3)
+        ds = nailfile.DataLoader().load(reader, auto_number_field=None)
+        columns = ds.column_schema('tbl')
+        self.assertEqual([c.DATA_TYPE for c in columns],
+                         ['INTEGER', 'INTEGER', 'REAL', 'varchar(255)', 'date', 'varchar(255)'])
+        rows = ds.fetchall('select * from tbl order by id')
+        self.assertEqual([r.line_num for r in rows], [2, 3, 4, 5])
+        self.assertEqual(rows[0].amount, 12.5)
+        self.assertEqual(rows[0].zip, '01234')
+        self.assertEqual(rows[3].amount, 'n/a')
+        self.assertEqual(ds.scalar('select sum(id) from tbl where amount between 10 and 200'), 4)
+
+    def test_compact_rows_support_key_attribute_and_index_access(self):
+        ds = self.load_collection_data()
+        rows = ds.fetchall('select person_num, name from tbl order by person_num')
+        self.assertIsInstance(rows[0], nailfile.CompactRow)
+        self.assertIs(type(rows[0]), type(rows[1]))
+        self.assertEqual(rows[0].name, 'Cliff Huxtable')
+        self.assertEqual(rows[0]['name'], 'Cliff Huxtable')
+        self.assertEqual(rows[0][0], '1')
+        self.assertEqual(rows[0].fields, ['person_num', 'name'])
+        self.assertEqual(rows[0].values, ['1', 'Cliff Huxtable'])
+        self.assertRaises(AttributeError, getattr, rows[0], 'gender')
+
+    def test_row_types(self):
+        ds = self.load_collection_data(exclude_extra_fields=True)
+        for row_type in ('compact', 'datarow', 'tuple'):
+            ds.row_type = row_type
+            self.assertEqual(ds.row_type, row_type)
+            self.assertEqual(ds.scalar('select count(*) from tbl'), 7)
+            self.assertEqual(len(ds.column_schema('tbl')), 5)
+            html = nailfile.to_html(ds.fetchall('select name from tbl where person_num = 1'))
+            self.assertIn('<td>Cliff&nbsp;Huxtable</td>', html)
+        self.assertEqual(ds.fetchone('select person_num, name from tbl where person_num = 2'), ('2', 'Clair Huxtable'))
+        self.assertRaises(ValueError, setattr, ds, 'row_type', 'dict')
+
+    def test_fetch_columns(self):
+        ds = nailfile.DataStore()
+        ds.execute('create table nums (i integer, r real, t text)')
+        for i in range(25):
+            ds.execute('insert into nums values (?, ?, ?)', (i, i / 2.0, None if i % 5 else str(i)))
+        columns = ds.fetch_columns('select i, r, t from nums order by i', batch_size=7)
+        self.assertEqual(list(columns.keys()), ['i', 'r', 't'])
+        self.assertEqual(list(columns['i']), list(range(25)))
+        self.assertEqual(list(columns['r'])[3], 1.5)
+        self.assertEqual(list(columns['t'])[0:6], ['0', None, None, None, None, '5'])
+
+        chunks = list(ds.iter_columns('select i from nums order by i', chunk_size=10))
+        self.assertEqual([len(c['i']) for c in chunks], [10, 10, 5])
+
+        empty = ds.fetch_columns('select i, t from nums where i < 0')
+        self.assertEqual([len(c) for c in empty.values()], [0, 0])
+
+    def test_load_builds_requested_indexes(self):
+        fn_get_list_data = lambda: (c for c in self.get_list_data())
+        reader = readers.CollectionReader(fn_get_list_data)
+        loader = nailfile.DataLoader()
+        ds = loader.load(reader, indexes={'tbl': ['name', ('gender', 'relationship')]})
+        names = [r.name for r in ds.fetchall("select name from sqlite_master where type = 'index' order by name")]
+        self.assertEqual(names, ['ix_tbl_gender_relationship', 'ix_tbl_name'])
+        self.assertEqual(list(loader.index_build_times.keys()), ['tbl'])
+        self.assertEqual(ds.scalar("select count(*) from sqlite_master where name = 'sqlite_stat1'"), 1)
+
+    def test_load_stats(self):
+        data = [['a', 'b'], ['1', '2'], ['3', '4', '5'], ['6', '7', '8', '9']]
+        reader = readers.CollectionReader(lambda: (r for r in data))
+        calls = []
+        loader = nailfile.DataLoader(batch_size=1, progress=calls.append, progress_interval=0)
+        ds = loader.load(reader, indexes={'tbl': ['a']})
+        stats = ds.load_stats
+        self.assertIs(stats, loader.stats)
+        self.assertEqual((stats.rows, stats.table_rows['tbl'], stats.alter_count), (3, 3, 2))
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(list(stats.stage_seconds), list(nailfile.LoadStats.STAGES))
+        self.assertTrue(all(v >= 0 for v in stats.stage_seconds.values()))
+        self.assertLessEqual(sum(stats.stage_seconds.values()), stats.elapsed)
+        self.assertEqual(list(stats.as_dict()['index_build_times']), ['tbl'])
+        self.assertIsNone(nailfile.DataLoader().load(readers.CollectionReader(lambda: iter(data))).load_stats)
+
+    def test_load_auto_indexes_selective_columns(self):
+        data = [['id', 'state', 'constant', 'note']]
+        for i in range(200):
+            data.append([str(i), 'MN' if i % 2 else 'WI', 'x', 'n' * 100])
+        fn_get_list_data = lambda: (c for c in data)
+        loader = nailfile.DataLoader()
+        ds = loader.load(readers.CollectionReader(fn_get_list_data), indexes='auto')
+        names = [r.name for r in ds.fetchall("select name from sqlite_master where type = 'index' order by name")]
+        self.assertEqual(names, ['ix_tbl_id', 'ix_tbl_state'])
+
+    def test_multi_record_fixed_width_loads_tables_by_record_type(self):
+        lines = [
+            'H20140301PAYER ONE',
+            'D00001Cliff     M',
+            'D00002Clair     F',
+            'T00002',
+            'H20140302PAYER TWO',
+            'D00003Theo      M',
+            'T00001',
+        ]
+        layouts = {
+            'H': readers.RecordLayout((1, 8, 20), ('rec_type', 'file_date', 'payer'), 'header'),
+            'D': ((1, 5, 10, 1), ('rec_type', 'person_num', 'name', 'gender'), 'detail'),
+            'T': ((1, 5), ('rec_type', 'record_count'), 'trailer'),
+        }
+        reader = readers.MultiRecordFixedWidthReader(lambda: iter(lines), layouts, 0, 1,
+                                                     remainder_field_name=None)
+        ds = nailfile.DataLoader(batch_size=2).load(reader)
+        self.assertEqual(sorted(t.TABLE_NAME for t in ds.table_schema()), ['detail', 'header', 'trailer'])
+        details = ds.fetchall('select line_num, name from detail order by row_id')
+        self.assertEqual([(r.line_num, r.name) for r in details], [(2, 'Cliff'), (3, 'Clair'), (6, 'Theo')])
+        self.assertEqual(ds.scalar("select payer from header where line_num = 5"), 'PAYER TWO')
+        self.assertEqual(ds.scalar('select count(*) from trailer'), 2)
+
+        for sample_size in (1, 4, 1000):
+            reader = readers.TypeInferenceReader(readers.MultiRecordFixedWidthReader(
+                lambda: iter(lines), layouts, 0, 1, remainder_field_name=None), sample_size=sample_size)
+            ds = nailfile.DataLoader(batch_size=2).load(reader)
+            self.assertEqual(ds.scalar('select sum(record_count) from trailer'), 3)
+            self.assertEqual(ds.scalar("select payer from header where line_num = 5"), 'PAYER TWO')
+            self.assertEqual(ds.scalar('select name from detail where line_num = 6'), 'Theo')
+            self.assertEqual(ds.scalar('select file_date from header where line_num = 1'), 20140301)
+            self.assertEqual(reader.column_types('header'), (None, 'integer', None))
+
+    def test_multi_record_layouts_sharing_a_table_must_agree(self):
+        layouts = {
+            'H': ((1, 2, 2), ('rec_type', 'h1', 'h2'), 'records'),
+            'T': ((1, 2, 2), ('rec_type', 't1', 't2'), 'records'),
+        }
+        self.assertRaises(ValueError, readers.MultiRecordFixedWidthReader, lambda: [], layouts, 0, 1)
+        layouts['T'] = ((1, 2, 2, 1), ('rec_type', 'h1', 'h2', 'flag'), 'records')
+        reader = readers.MultiRecordFixedWidthReader(lambda: ['H1122', 'T3344Y', 'H5566'], layouts, 0, 1,
+                                                     remainder_field_name=None)
+        ds = nailfile.DataLoader().load(reader)
+        rows = ds.fetchall('select rec_type, h1, flag from records order by line_num')
+        self.assertEqual([tuple(r.values) for r in rows], [('H', '11', None), ('T', '33', 'Y'), ('H', '55', None)])
+
+    def test_loader_inserts_by_field_name(self):
+        class SwappingReader(readers.DataReader):
+            def read(self):
+                for names, row in ((('a', 'b'), ('1', '2')), (('b', 'a'), ('4', '3'))):
+                    self._set_fields_by_name(names)
+                    self._line_number += 1
+                    yield row
+
+        ds = nailfile.DataLoader().load(SwappingReader())
+        rows = ds.fetchall('select a, b from tbl order by line_num')
+        self.assertEqual([tuple(r.values) for r in rows], [('1', '2'), ('3', '4')])
+
+    def test_multi_record_fixed_width_unknown_record_type(self):
+        layouts = {'D': ((1, 5), ('rec_type', 'person_num'), 'detail')}
+        reader = readers.MultiRecordFixedWidthReader(lambda: ['D00001', 'X00002'], layouts, 0, 1)
+        self.assertRaises(ValueError, list, reader.read())
+        reader.skip_unknown = True
+        self.assertEqual(list(reader.read()), [('D', '00001', None)])
+
+    def test_load_incremental_skips_appends_and_reloads(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(tmpdir, name) for name in ('a.csv', 'b.csv', 'c.csv')]
+            for path in paths:
+                with open(path, 'w') as outfile:
+                    outfile.write("num,name\n1,one\n2,two\n")
+            conn = sqlite3.connect(os.path.join(tmpdir, 'test.db'))
+            conn.row_factory = nailfile.DataStore.compact_row_factory
+            loader = nailfile.DataLoader()
+            factory = lambda stream, table_name: readers.CsvReader(stream, table_name)
+            ds = loader.load_incremental(paths, factory, conn, table_name='tbl', complete_lines=True)
+            self.assertEqual(ds.scalar('select count(*) from tbl'), 6)
+            self.assertEqual(set(loader.incremental_report.values()), {'loaded'})
+
+            with open(paths[1], 'a') as outfile:
+                outfile.write("3,three\n")
+            with open(paths[2], 'w') as outfile:
+                outfile.write("num,name\n9,nine\n")
+            ds = loader.load_incremental(paths, factory, conn, table_name='tbl', complete_lines=True)
+            self.assertEqual(list(loader.incremental_report.values()), ['skipped', 'appended', 'reloaded'])
+            self.assertEqual(ds.scalar('select count(*) from tbl'), 6)
+            rows = ds.fetchall('select line_num, name from tbl where source_file = ? order by line_num',
+                               params=os.path.abspath(paths[1]))
+            self.assertEqual([(r.line_num, r.name) for r in rows], [(2, 'one'), (3, 'two'), (4, 'three')])
+            self.assertEqual(ds.scalar('select name from tbl where source_file = ?', os.path.abspath(paths[2])),
+                             'nine')
+            conn.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_load_incremental_waits_for_a_partial_last_line(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'a.csv')
+            with open(path, 'w') as outfile:
+                outfile.write("num,val\n1,2\n7,")
+            conn = sqlite3.connect(os.path.join(tmpdir, 'test.db'))
+            conn.row_factory = nailfile.DataStore.compact_row_factory
+            loader = nailfile.DataLoader()
+            factory = lambda stream, table_name: readers.CsvReader(stream, table_name)
+            ds = loader.load_incremental([path], factory, conn, complete_lines=True)
+            self.assertEqual(ds.fetchall('select num, val from a order by line_num'), [('1', '2')])
+
+            ds = loader.load_incremental([path], factory, conn, complete_lines=True)
+            self.assertEqual(list(loader.incremental_report.values()), ['skipped'])
+
+            with open(path, 'a') as outfile:
+                outfile.write("8\n")
+            ds = loader.load_incremental([path], factory, conn, complete_lines=True)
+            self.assertEqual(list(loader.incremental_report.values()), ['appended'])
+            self.assertEqual(ds.fetchall('select line_num, num, val from a order by line_num'),
+                             [(2, '1', '2'), (3, '7', '8')])
+            conn.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_load_incremental_loads_whole_files_and_only_fingerprints_finished_reads(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'a.csv')
+            with open(path, 'w') as outfile:
+                outfile.write("num,val\n1,2\n3,4\n5,6")
+            conn = sqlite3.connect(os.path.join(tmpdir, 'test.db'))
+            loader = nailfile.DataLoader()
+            limited = lambda stream, table_name: readers.DataReaderLimiter(readers.CsvReader(stream, table_name), 1)
+            ds = loader.load_incremental([path], limited, conn)
+            self.assertEqual(ds.scalar('select count(*) from a'), 1)
+            self.assertIsNone(ds.scalar('select size from nailfile_files'))
+
+            factory = lambda stream, table_name: readers.CsvReader(stream, table_name)
+            ds = loader.load_incremental([path], factory, conn)
+            self.assertEqual(list(loader.incremental_report.values()), ['reloaded'])
+            self.assertEqual(ds.scalar('select count(*) from a'), 3)
+            ds = loader.load_incremental([path], factory, conn)
+            self.assertEqual(list(loader.incremental_report.values()), ['skipped'])
+
+            with open(path, 'a') as outfile:
+                outfile.write("\n7,8\n")
+            ds = loader.load_incremental([path], factory, conn)
+            self.assertEqual(list(loader.incremental_report.values()), ['reloaded'])
+            self.assertEqual(ds.scalar('select max(line_num) from a'), 5)
+            self.assertEqual(ds.scalar('select count(*) from a'), 4)
+            conn.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_load_many_files_into_per_file_or_shared_tables(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for day in range(1, 6):
+                with open(os.path.join(tmpdir, 'day{0}.csv'.format(day)), 'w') as outfile:
+                    outfile.write("num,name\n")
+                    for i in range(day * 100):
+                        outfile.write("{0},{1}\n".format(i, day))
+            pattern = os.path.join(tmpdir, 'day*.csv')
+            factory = lambda path, table_name: readers.CsvReader(path, table_name)
+
+            loader = nailfile.DataLoader(batch_size=7)
+            ds = loader.load_many(pattern, factory, workers=3)
+            self.assertEqual(len(loader.loaded_files), 5)
+            self.assertEqual(ds.scalar('select count(*) from day4'), 400)
+            self.assertEqual(ds.scalar('select min(source_file) from day2'), os.path.join(tmpdir, 'day2.csv'))
+
+            ds = loader.load_many(pattern, factory, table_name='days', workers=3)
+            self.assertEqual(ds.scalar('select count(*) from days'), 1500)
+            self.assertEqual(ds.scalar('select count(distinct source_file) from days'), 5)
+            rows = ds.fetchall("select line_num from days where name = '3' order by row_id")
+            self.assertEqual([r.line_num for r in rows], list(range(2, 302)))
+
+            def failing_factory(path, table_name):
+                if path.endswith('day3.csv'):
+                    raise IOError("unreadable")
+                return factory(path, table_name)
+            self.assertRaises(IOError, loader.load_many, pattern, failing_factory, workers=2)
+            self.assertRaises(ValueError, loader.load_many, os.path.join(tmpdir, '*.missing'), factory)
+
+            clashing = [os.path.join(tmpdir, name) for name in ('a-1.csv', 'a_1.csv')]
+            for path in clashing:
+                with open(path, 'w') as outfile:
+                    outfile.write("num\n1\n")
+            self.assertRaises(ValueError, loader.load_many, clashing, factory)
+            self.assertRaises(ValueError, loader.load_incremental, clashing, factory)
+            ds = loader.load_many(clashing, factory, table_name='both')
+            self.assertEqual(ds.scalar('select count(*) from both'), 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_export_csv_and_jsonl(self):
+        ds = self.load_collection_data(exclude_extra_fields=True)
+        out = io.StringIO()
+        count = ds.export_csv('tbl', out, batch_size=3)
+        self.assertEqual(count, 7)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'person_num,name,gender,dob,relationship')
+        self.assertEqual(lines[1], '1,Cliff Huxtable,M,19370712,dad')
+        self.assertEqual(lines[3], '3,Sondra Huxtable Tibideaux,F,,daughter')
+
+        out = io.StringIO()
+        count = ds.export_jsonl('select name, dob from tbl where gender = ?', out, params='M')
+        self.assertEqual(count, 2)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(rows[0], {'name': 'Cliff Huxtable', 'dob': '19370712'})
+        self.assertIsNone(rows[1]['dob'])
+
+    def mixed_type_data(self):
+        ds = nailfile.DataStore()
+        ds.execute('create table mixed (n integer, a, b)')
+        for row in [(1, None, 1), (2, None, 2), (3, 7, 'x'), (4, 8, 2.5)]:
+            ds.execute('insert into mixed values (?, ?, ?)', row)
+        return ds
+
+    def test_export_storage_classes_cover_every_batch(self):
+        ds = self.mixed_type_data()
+        self.assertEqual(ds._storage_classes('select n, a, b from mixed where n > ?;', 0, 3),
+                         [{'integer'}, {'integer'}, {'integer', 'text', 'real'}])
+
+    @unittest.skipUnless(pyarrow, "pyarrow is not installed")
+    def test_export_parquet_types_span_batches(self):
+        ds = self.mixed_type_data()
+        out = io.BytesIO()
+        self.assertEqual(ds.export_parquet('mixed', out, batch_size=2), 4)
+        table = pyarrow.parquet.read_table(io.BytesIO(out.getvalue()))
+        self.assertEqual([str(f.type) for f in table.schema], ['int64', 'int64', 'string'])
+        self.assertEqual(table.column('a').to_pylist(), [None, None, 7, 8])
+        self.assertEqual(table.column('b').to_pylist(), ['1', '2', 'x', '2.5'])
+
+    def test_dump_and_save(self):
+        ds = self.load_collection_data()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            sqlfile = os.path.join(tmpdir, 'dump.sql')
+            ds.dump(sqlfile)
+            restored = nailfile.DataStore()
+            with open(sqlfile) as infile:
+                restored._conn.executescript(infile.read())
+            self.assertEqual(restored.scalar('select count(*) from tbl'), 7)
+
+            dbfile = os.path.join(tmpdir, 'copy.db')
+            ds.save(dbfile)
+            saved = nailfile.DataStore(sqlite3.connect(dbfile), row_type='compact')
+            self.assertEqual(saved.scalar('select name from tbl where person_num = ?', '5'), 'Theo Huxtable')
+            saved._conn.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_only_connect_quotes_the_path(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'we#ird ?.db')
+            conn = sqlite3.connect(path)
+            conn.execute('create table t (a)')
+            conn.commit()
+            conn.close()
+            ds = nailfile.DataStore(nailfile.connect(path, read_only=True))
+            self.assertEqual(ds.scalar("select count(*) from sqlite_master where name = 't'"), 1)
+            self.assertRaises(sqlite3.OperationalError, ds.execute, 'create table u (a)')
+            ds._conn.close()
+            self.assertEqual(os.listdir(tmpdir), ['we#ird ?.db'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_pool_queries_shared_memory_load_from_threads(self):
+        uri = nailfile.shared_memory_uri('test_pool')
+        writer = nailfile.connect(uri, uri=True)
+        fn_get_list_data = lambda: (c for c in self.get_list_data())
+        nailfile.DataLoader().load(readers.CollectionReader(fn_get_list_data), connection=writer)
+
+        pool = nailfile.DataStorePool(uri, size=2, uri=True)
+        counts = []
+
+        def query():
+            with pool.datastore() as ds:
+                counts.append(ds.scalar('select count(*) from tbl'))
+
+        threads = [threading.Thread(target=query) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(counts, [7] * 6)
+        with pool.datastore() as ds:
+            self.assertRaises(sqlite3.OperationalError, ds.execute, 'delete from tbl')
+        with pool.datastore() as ds:
+            self.assertEqual(ds.row_type, 'compact')
+            pool.close()
+        with self.assertRaises(ValueError):
+            with pool.datastore(timeout=0.1):
+                pass
+        self.assertRaises(ValueError, nailfile.connect, row_type='dict')
+        writer.close()
+
+    def test_query_cache_hits_and_invalidation(self):
+        ds = nailfile.DataStore(cache=True)
+        ds.execute('create table a (n integer)')
+        ds.execute('create table b (n integer)')
+        ds.execute('insert into a values (1)')
+        ds.execute('insert into b values (10)')
+        self.assertEqual(ds.scalar('select sum(n) from a'), 1)
+        self.assertEqual(ds.scalar('select  sum(n)\n from a'), 1)
+        self.assertEqual(ds.scalar('select sum(n) from b'), 10)
+        self.assertEqual(ds.cache.hits, 1)
+
+        ds.execute('insert into b values (20)')
+        self.assertEqual(ds.scalar('select sum(n) from a'), 1)
+        self.assertEqual(ds.scalar('select sum(n) from b'), 30)
+        self.assertEqual(ds.cache.hits, 2)
+
+        # writes that bypass execute clear the whole cache
+        fn_get_list_data = lambda: (c for c in [['n'], [5]])
+        nailfile.DataLoader().load(readers.CollectionReader(fn_get_list_data, table_name='a'),
+                                   connection=ds._conn, auto_number_field=None, record_number_field=None)
+        self.assertEqual(ds.scalar('select sum(n) from a'), 6)
+        self.assertEqual(ds.cache.stats()['hits'], 2)
+
+    def test_query_cache_sees_trigger_and_schema_qualified_writes(self):
+        ds = nailfile.DataStore(cache=True)
+        ds.execute('create table a (n integer)')
+        ds.execute('create table b (n integer)')
+        ds.execute('create trigger copy_a after insert on a begin insert into b values (new.n); end')
+        self.assertEqual(ds.scalar('select count(*) from b'), 0)
+        ds.execute('insert into a values (1)')
+        self.assertEqual(ds.scalar('select count(*) from b'), 1)
+
+        self.assertEqual(ds.scalar('select count(*) from a'), 1)
+        self.assertEqual(nailfile.QueryCache.write_target('insert into main.a values (2)'), 'a')
+        ds.execute('insert into main.a values (2)')
+        self.assertEqual(ds.scalar('select count(*) from a'), 2)
+
+    def test_query_cache_evicts_to_budget(self):
+        ds = nailfile.DataStore(cache=4000)
+        ds.execute('create table a (n integer, t text)')
+        for i in range(20):
+            ds.execute('insert into a values (?, ?)', (i, 'x' * 100))
+        for i in range(20):
+            ds.fetchall('select * from a where n = ?', i)
+        self.assertLessEqual(ds.cache.size, 4000)
+        self.assertGreater(ds.cache.evictions, 0)
+        self.assertEqual(nailfile.QueryCache.normalize("select  'a  b'\n  from t"), "select 'a  b' from t")
+
+    def test_iter_html_limits_rows(self):
+        ds = self.load_collection_data(exclude_extra_fields=True)
+        rows = ds.fetchall('select person_num, name from tbl order by person_num')
+        chunks = list(nailfile.iter_html(rows, max_rows=3, chunk_rows=2))
+        self.assertGreater(len(chunks), 1)
+        html = os.linesep.join(chunks)
+        self.assertEqual(html, nailfile.to_html(rows, max_rows=3))
+        self.assertIn('<tr><th>person_num</th><th>name</th></tr>', html)
+        self.assertIn('<td>Clair&nbsp;Huxtable</td>', html)
+        self.assertNotIn('Denise', html)
+        self.assertIn('<tr><td colspan="2"><em>4 more rows</em></td></tr>', html)
+        self.assertEqual(nailfile.to_html([(None, 'a<b & c')], fields=['x', 'y']).split(os.linesep)[2],
+                         '<tr><td><em>&lt;NULL&gt;</em></td><td>a&lt;b&nbsp;&amp;&nbsp;c</td></tr>')
+
+    def test_iter_html_does_not_drain_iterators(self):
+        consumed = []
+
+        def rows():
+            for i in range(1000000):
+                consumed.append(i)
+                yield (i,)
+
+        html = nailfile.to_html(rows(), fields=['n'], max_rows=2)
+        self.assertIn('<tr><td colspan="1"><em>more rows</em></td></tr>', html)
+        self.assertEqual(len(consumed), 3)
+        html = nailfile.to_html(iter([(1,), (2,)]), fields=['n'], max_rows=2)
+        self.assertNotIn('more rows', html)
+
+    def test_query_result_repr_html_shows_head_and_tail(self):
+        ds = nailfile.DataStore(row_type='tuple')
+        ds.execute('create table nums (n integer)')
+        for i in range(50):
+            ds.execute('insert into nums values (?)', i)
+        result = ds.fetchall('select n from nums order by n')
+        self.assertEqual(result.fields, ['n'])
+        html = result._repr_html_()
+        self.assertIn('<tr><th>n</th></tr>', html)
+        self.assertIn('<td>9</td>', html)
+        self.assertNotIn('<td>10</td>', html)
+        self.assertIn('30 more rows', html)
+        self.assertIn('<td>49</td>', html)
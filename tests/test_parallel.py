@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+from nailfile import readers
+from nailfile import nailfile
+from nailfile import parallel
+
+
+class ParallelReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, filename, lines):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'w', newline='') as outfile:
+            outfile.write("\r\n".join(lines) + "\r\n")
+        return path
+
+    def test_record_ranges_end_on_line_boundaries(self):
+        path = self.write_file('lines.txt', ["line{0:04d}".format(i) for i in range(100)])
+        ranges = parallel.record_ranges(path, chunk_size=50)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(path))
+        with open(path, 'rb') as infile:
+            data = infile.read()
+        for start, end in ranges:
+            self.assertTrue(data[start:end].endswith(b"\r\n"))
+
+    def test_parallel_csv_matches_csv_reader(self):
+        lines = ["num,name,extra"] + ["{0},name {0}".format(i) for i in range(500)] + ["500,last,x,y"]
+        path = self.write_file('data.csv', lines)
+        reader = parallel.ParallelCsvReader(path, processes=2, chunk_size=1000)
+        ds = nailfile.DataLoader().load(reader)
+        expected = nailfile.DataLoader().load(readers.CsvReader(path))
+        sql = 'select line_num, num, name, extra, unnamed_field004 from tbl order by row_id'
+        self.assertEqual([r.values for r in ds.fetchall(sql)], [r.values for r in expected.fetchall(sql)])
+        self.assertEqual(ds.scalar('select max(line_num) from tbl'), 502)
+
+    def test_parallel_fixed_width_matches_fixed_width_reader(self):
+        lines = ["{0:05d}{1:<10}X".format(i, "name" + str(i)) for i in range(300)]
+        path = self.write_file('data.txt', lines)
+        reader = parallel.ParallelFixedWidthReader(path, (5, 10), ('num', 'name'), processes=3, chunk_size=512)
+        rows = list(reader.read())
+        expected = readers.FixedWidthReader(readers.file_lines(path), (5, 10), ('num', 'name'))
+        self.assertEqual(rows, list(expected.read()))
+        self.assertEqual(reader.line_number, 300)
+
+    def test_parallel_fixed_width_without_strip_matches_file_lines(self):
+        path = self.write_file('data.txt', ["ab   cd", "xy"])
+        reader = parallel.ParallelFixedWidthReader(path, (2, 3), strip_values=False, processes=1)
+        expected = readers.FixedWidthReader(readers.file_lines(path), (2, 3), strip_values=False)
+        self.assertEqual(list(reader.read()), list(expected.read()))
+        self.assertEqual(list(expected.read()), [('ab', '   ', 'cd'), ('xy', None, None)])
+
+    def test_parallel_csv_rejects_quoted_newline_across_ranges(self):
+        path = self.write_file('data.csv', ['n,t', '1,"x', 'y"', '2,z'])
+        reader = parallel.ParallelCsvReader(path, processes=1, chunk_size=1)
+        self.assertRaises(ValueError, list, reader.read())
+        reader = parallel.ParallelCsvReader(path, processes=1, chunk_size=1000)
+        self.assertEqual(list(reader.read()), [('1', 'x\r\ny'), ('2', 'z')])
@@ -142,3 +142,198 @@
 #         self.assertEqual(len(guys), 2)
 #         self.assertTrue(guys[0].name.startswith('Theo'))
 #         self.assertTrue(guys[1].name.startswith('Cliff'))
+
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from nailfile import readers
+from nailfile import nailfile
+
+
+class OneShotStream(io.StringIO):
+    """
+    A text stream that cannot be rewound, like a pipe or stdin
+    """
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise io.UnsupportedOperation("seek")
+
+
+class ReaderTests(unittest.TestCase):
+    CSV_DATA = "person_num,name,gender\n1,Cliff Huxtable,M\n2,Clair Huxtable,F\n"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, filename, data):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'wb') as outfile:
+            outfile.write(data)
+        return path
+
+    def test_csv_reader_reads_one_shot_stream(self):
+        reader = readers.CsvReader(OneShotStream(self.CSV_DATA))
+        self.assertEqual([f.name for f in reader.fields], ['person_num', 'name', 'gender'])
+        rows = list(reader.read())
+        self.assertEqual(rows, [('1', 'Cliff Huxtable', 'M'), ('2', 'Clair Huxtable', 'F')])
+        self.assertEqual(reader.line_number, 3)
+
+    def test_collection_reader_gets_data_once_for_first_read(self):
+        calls = []
+
+        def fn_get_data():
+            calls.append(1)
+            return iter([['a', 'b'], [1, 2], [3, 4]])
+
+        reader = readers.CollectionReader(fn_get_data)
+        self.assertEqual(list(reader.read()), [(1, 2), (3, 4)])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(list(reader.read()), [(1, 2), (3, 4)])
+        self.assertEqual(len(calls), 2)
+
+    def test_fixed_width_splits_lines_and_remainder(self):
+        lines = ['00001Cliff   M19370712dad  extra', '00002Clair   F', '', '00003Theo    M        son']
+        widths = (5, 8, 1, 8, 5)
+        expected = [
+            ('00001', 'Cliff', 'M', '19370712', 'dad', 'extra'),
+            ('00002', 'Clair', 'F', None, None, None),
+            (None, None, None, None, None, None),
+            ('00003', 'Theo', 'M', None, 'son', None),
+        ]
+        reader = readers.FixedWidthReader(lambda: iter(lines), widths)
+        self.assertEqual(list(reader.read()), expected)
+        self.assertEqual(reader.line_number, 4)
+
+    def test_fixed_width_without_strip_or_remainder(self):
+        reader = readers.FixedWidthReader(lambda: ['ab  cd'], (4,), remainder_field_name=None, strip_values=False)
+        self.assertEqual(list(reader.read()), [('ab  ',)])
+        self.assertEqual(len(reader.fields), 1)
+
+    def test_mmap_fixed_width_reads_terminated_records(self):
+        path = self.write_file('people.txt', b'00001Cliff   M\r\n00002Clair   F\r\n00003Th\xc3\xa9o   M')
+        reader = readers.MmapFixedWidthReader(path, (5, 8, 1), ('person_num', 'name', 'gender'))
+        rows = list(reader.read())
+        self.assertEqual(rows, [('00001', 'Cliff', 'M', None), ('00002', 'Clair', 'F', None),
+                                ('00003', 'Th\xe9o', 'M', None)])
+        self.assertEqual(reader.line_number, 3)
+
+    def test_mmap_fixed_width_reads_unterminated_records(self):
+        path = self.write_file('people.dat', b'00001Cliff   M00002Clair   F')
+        reader = readers.MmapFixedWidthReader(path, (5, 8, 1), ('person_num', 'name', 'gender'),
+                                              record_length=14, keep_fields=('person_num', 'gender'))
+        self.assertEqual([f.name for f in reader.fields], ['person_num', 'gender'])
+        self.assertEqual(list(reader.read()), [('00001', 'M'), ('00002', 'F')])
+
+    def test_mmap_fixed_width_blocks_match_record_reads(self):
+        data = b'00001Cliff   M\r\n00002Clair   F\n00003Th\xc3\xa9o   M\n00004Denise  F\n'
+        path = self.write_file('people.txt', data)
+        reader = readers.MmapFixedWidthReader(path, (5, 8, 1), ('person_num', 'name', 'gender'))
+        expected = list(reader.read())
+        reader.BLOCK_SIZE = 10
+        self.assertEqual(list(reader.read()), expected)
+        self.assertEqual(expected[2], ('00003', 'Th\xe9o', 'M', None))
+        rows = reader.read()
+        self.assertEqual(next(rows), expected[0])
+        rows.close()
+
+        path = self.write_file('people.dat', data.replace(b'\r', b'').replace(b'\n', b''))
+        reader = readers.MmapFixedWidthReader(path, (5, 8, 1), record_length=14)
+        reader.BLOCK_SIZE = 20
+        self.assertEqual([r[1] for r in reader.read()], ['Cliff', 'Clair', 'Th\xe9o', 'Denise'])
+
+    def test_x12_reader_tokenizes_segments_across_blocks(self):
+        isa = "ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECEIVER       " \
+              "*140301*1200*^*00501*000000001*0*P*:~"
+        data = isa + "GS*BE*SENDER*RECEIVER*20140301*1200*1*X*005010X220A1~\n" \
+                     "ST*834*0001*005010X220A1~INS*Y*18*021*28*A***FT~NM1*IL*1*HUXTABLE*CLIFF~" \
+                     "INS*N*19*021*28*A***FT~NM1*IL*1*HUXTABLE*CLAIR*M~SE*6*0001~GE*1*1~IEA*1*000000001~"
+        reader = readers.X12Reader(io.StringIO(data), block_size=16)
+        rows = [(reader.table_name, reader.line_number, row) for row in reader.read()]
+        self.assertEqual(reader.element_separator, '*')
+        self.assertEqual(reader.sub_element_separator, ':')
+        self.assertEqual([r[0] for r in rows], ['ISA', 'GS', 'ST', 'INS', 'NM1', 'INS', 'NM1', 'SE', 'GE', 'IEA'])
+        self.assertEqual(rows[6], ('NM1', 7, ('IL', '1', 'HUXTABLE', 'CLAIR', 'M')))
+        self.assertEqual(rows[3][2][5], None)
+
+    def test_x12_reader_loads_segment_tables(self):
+        isa = "ISA*00*          *00*          *ZZ*SENDER         *ZZ*RECEIVER       " \
+              "*140301*1200*^*00501*000000001*0*P*:~"
+        path = self.write_file('enroll.834', (isa + "NM1*IL*1*HUXTABLE*CLIFF~NM1*IL*1*HUXTABLE*CLAIR*M~").encode())
+        ds = nailfile.DataLoader().load(readers.X12Reader(path))
+        self.assertEqual(ds.scalar('select count(*) from NM1'), 2)
+        self.assertEqual(ds.scalar('select NM104 from NM1 where NM105 is not null'), 'CLAIR')
+
+    def test_schema_version_changes_only_with_schema(self):
+        data = [['a', 'b'], ['1', '2'], ['3', '4'], ['5', '6', '7']]
+        reader = readers.SourceFileReader(readers.CollectionReader(lambda: iter(data)), 'data.csv')
+        seen = []
+        for row in reader.read():
+            seen.append((reader.schema_version, reader.fields))
+        self.assertEqual(seen[0][0], seen[1][0])
+        self.assertIs(seen[0][1], seen[1][1])
+        self.assertNotEqual(seen[1][0], seen[2][0])
+        self.assertEqual([f.name for f in seen[2][1]], ['source_file', 'a', 'b', 'unnamed_field003'])
+
+        layouts = {'H': ([1, 5], ['type', 'name']), 'D': ([1, 3, 2], ['type', 'num', 'code'])}
+        reader = readers.MultiRecordFixedWidthReader(lambda: ['HCLIFF', 'D00101', 'D00202', 'HCLAIR'], layouts, 0, 1)
+        versions = [reader.schema_version for row in reader.read()]
+        self.assertEqual(versions[1], versions[2])
+        self.assertEqual(len(set(versions)), 3)
+
+    def test_compressed_input_is_detected_from_content(self):
+        expected = [('1', 'Cliff Huxtable', 'M'), ('2', 'Clair Huxtable', 'F')]
+        data = self.CSV_DATA.encode()
+        for name, compress in (('people.dat', gzip.compress), ('people.gz', bz2.compress), ('people', lzma.compress)):
+            path = self.write_file(name, compress(data))
+            self.assertEqual(list(readers.CsvReader(path).read()), expected)
+
+        path = self.write_file('codes.csv', b"BZhcode,x\n1,2\n")
+        self.assertIsNone(readers.detect_compression(path))
+        self.assertEqual(list(readers.CsvReader(path).read()), [('1', '2')])
+        self.assertEqual(readers.detect_compression(self.write_file('empty.bz2', bz2.compress(b''))), 'bz2')
+
+        path = os.path.join(self.tmpdir, 'people.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('people.csv', self.CSV_DATA)
+        self.assertEqual(readers.detect_compression(path), 'zip')
+        self.assertEqual(list(readers.CsvReader(path).read()), expected)
+
+        path = self.write_file('people.txt.gz', gzip.compress(b"01Cliff\r\n02Clair\r\n"))
+        reader = readers.FixedWidthReader(readers.file_lines(path), [2, 5], ['num', 'name'], strip_values=False)
+        self.assertEqual(list(reader.read()), [('01', 'Cliff', None), ('02', 'Clair', None)])
+        with self.assertRaises(ValueError):
+            list(readers.MmapFixedWidthReader(path, [2, 5]).read())
+
+    def test_zip_reader_loads_each_member(self):
+        path = os.path.join(self.tmpdir, 'family.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('parents.csv', self.CSV_DATA)
+            archive.writestr('kids/kids.csv', self.CSV_DATA.split("\n")[0] + ",age\n3,Theo Huxtable,M,16\n")
+        factory = lambda stream, table_name: readers.CsvReader(stream, table_name)
+
+        ds = nailfile.DataLoader().load(readers.ZipReader(path, factory))
+        self.assertEqual(ds.scalar('select count(*) from parents'), 2)
+        self.assertEqual(ds.scalar('select source_file from kids'), 'kids/kids.csv')
+
+        ds = nailfile.DataLoader().load(readers.ZipReader(path, factory, table_name='family'))
+        rows = ds.fetchall('select source_file, name, age from family order by row_id')
+        self.assertEqual([tuple(r.values) for r in rows], [('parents.csv', 'Cliff Huxtable', None),
+                                                           ('parents.csv', 'Clair Huxtable', None),
+                                                           ('kids/kids.csv', 'Theo Huxtable', '16')])
+
+        with zipfile.ZipFile(path, 'a') as archive:
+            archive.writestr('other.csv', "x,y\n1,2\n")
+        with self.assertRaises(ValueError):
+            list(readers.ZipReader(path, factory, table_name='family').read())